@@ -1,22 +1,134 @@
-from flask import Flask, jsonify, request, Response
-import inspect
+from flask import Flask, jsonify, request, Response, send_file
+import os
+import json
+import atexit
 import sys
 sys.path.append("/home/aerotract/software/aerotract_db/db")
 sys.stdout = sys.stderr
-from aerodb import AeroDB, list_aerodb_fns
+from aerodb import AeroDB
+from manifest import route_fns
+from compression import install_compression
+from profiling import install_profiling
+from jobs import JobManager
+from singleflight import SingleFlight, call_key
+from aggregates import SummariesMissing
+from guards import Budget, BudgetExceeded, limits_for, job_limits_for
+from writequeue import WriteQueue
 
 app = Flask(__name__)
 db = AeroDB()
 
+# Background jobs run under the job budgets (see JOB_LIMITS), and updates
+# still go through the write queue
+def run_job(fn_name, kw):
+    if fn_name == "update" and app.config['GROUP_COMMIT']:
+        return write_queue.submit(kw)
+    return getattr(db, fn_name)(**kw)
+
+job_manager = JobManager(
+    db, workers=2, run=run_job,
+    limits=lambda fn_name: job_limits_for(fn_name, app.config['JOB_LIMITS']))
+# spilled results don't outlive the process
+atexit.register(job_manager.close)
+single_flight = SingleFlight()
+# writes are never coalesced
+UNCOALESCED = ["update"]
+
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+app.config['COMPRESS_MIN_SIZE'] = 1024
+# per-method overrides of the execution budgets in guards.py, e.g.
+# {"default": {"seconds": 20}, "data_filter": {"max_rows": 200000}}
+app.config['METHOD_LIMITS'] = {}
+# the same for background jobs, over guards.JOB_LIMITS
+app.config['JOB_LIMITS'] = {}
+# updates are committed in groups by one writer thread, see writequeue.py
+app.config['GROUP_COMMIT'] = True
+app.config['GROUP_COMMIT_WINDOW'] = 0.005
+write_queue = WriteQueue(db, window=app.config['GROUP_COMMIT_WINDOW'],
+                         limits=limits_for("update", app.config['METHOD_LIMITS']))
+# load pandas and the column caches before serving, see prewarm()
+app.config['PREWARM'] = os.getenv("AERODB_PREWARM") == "1"
+install_compression(app)
+# opt-in per request profiling, enabled with AERODB_PROFILING=1
+install_profiling(app)
 
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store'
+    # results may be kept, but only by the client, and must be revalidated
+    # by ETag before each use
+    response.headers['Cache-Control'] = 'private, no-cache'
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Custom-Header'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Custom-Header, If-None-Match'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag'
+    return response
+
+# Tag buffered responses with a hash of their body, and answer 304 when the
+# client already holds that version. The tag is weak because the hash is of
+# the uncompressed body, and the same tag is sent for every Content-Encoding
+@app.after_request
+def add_etag(response):
+    if response.status_code != 200 or response.is_streamed or response.direct_passthrough:
+        return response
+    response.add_etag(weak=True)
+    etag, _ = response.get_etag()
+    if request.if_none_match.contains_weak(etag):
+        response.status_code = 304
+        response.set_data(b"")
     return response
 
+# Converts a list of records, or a dict of lists of records, to columns and
+# rows, which is smaller on the wire and decodes straight into DataFrames
+def to_columnar(data):
+    if isinstance(data, dict):
+        return {k: to_columnar(v) for k, v in data.items()}
+    if not isinstance(data, list):
+        return data
+    columns = []
+    seen = set()
+    for record in data:
+        for k in record.keys():
+            if k not in seen:
+                seen.add(k)
+                columns.append(k)
+    rows = [[record.get(c) for c in columns] for record in data]
+    return {"columns": columns, "rows": rows}
+
+# Calls an AeroDB method within its execution budget, sharing the result
+# with identical calls already in flight. Updates go through the write queue
+def run_fn(fn_name, kw):
+    kw = dict(kw)
+    kw.update({"json_out": True})
+    if fn_name == "update" and app.config['GROUP_COMMIT']:
+        return write_queue.submit(kw)
+    def call():
+        with Budget(fn_name, **limits_for(fn_name, app.config['METHOD_LIMITS'])):
+            return getattr(db, fn_name)(**kw)
+    if fn_name in UNCOALESCED:
+        return call()
+    return single_flight.do(call_key(fn_name, kw), call)
+
+# True for a query argument like ?async=1 or ?async=true, False when absent
+# or set to 0/false/no
+def arg_flag(name):
+    return request.args.get(name, "").lower() in ("1", "true", "yes", "on")
+
+# Serializes a call's result as jsonify would, checking its size against
+# the call's byte limit as the output grows, so an oversized result fails
+# before the whole body is built
+def dumps_checked(fn_name, obj):
+    budget = Budget(fn_name, **limits_for(fn_name, app.config['METHOD_LIMITS']))
+    encoder = json.JSONEncoder(
+        default=app.json.default, ensure_ascii=app.json.ensure_ascii,
+        sort_keys=app.json.sort_keys, separators=(",", ":"))
+    parts = []
+    size = 0
+    for piece in encoder.iterencode(obj):
+        parts.append(piece)
+        # with ensure_ascii every character is one byte
+        size += len(piece) if encoder.ensure_ascii else len(piece.encode())
+        budget.check_bytes(size)
+    return "".join(parts)
+
 # This function dynamically generates a Flask endpoint function for a given 
 # method name of the AeroDB class
 def make_route_fn(fn_name):
@@ -26,19 +138,98 @@ def make_route_fn(fn_name):
         if kw is None:
             kw = {}
         kw.update({"json_out": True})
+        # With ?async=1 the call runs as a background job and the job's
+        # status is returned right away
+        if arg_flag("async"):
+            return jsonify(job_manager.submit(fn_name, kw)), 202
         # Call the specified AeroDB method with the JSON data as arguments
-        fn = getattr(db, fn_name)(**kw)
+        fn = run_fn(fn_name, kw)
+        if request.args.get("format") == "columns":
+            fn = to_columnar(fn)
         # Return the result of the AeroDB method as a JSON response
-        result = jsonify(fn)
-        return result
+        return Response(dumps_checked(fn_name, fn) + "\n", mimetype=app.json.mimetype)
     return call_fn
 
+@app.errorhandler(BudgetExceeded)
+def budget_exceeded(e):
+    status = 504 if e.kind == "time" else 413
+    return jsonify({"error": str(e), "fn": e.fn, "limit": e.kind, "value": e.limit}), status
+
+# the summary tables haven't been built on this server yet, which the
+# operator fixes by running rebuild_summaries
+@app.errorhandler(SummariesMissing)
+def summaries_missing(e):
+    return jsonify({"error": str(e), "level": e.level}), 503
+
+@app.route("/manifest")
+def manifest():
+    return jsonify({"fns": route_fns()})
+
+# Runs several AeroDB calls from one request. The body is
+# {"calls": [{"fn": ..., "kwargs": {...}}, ...]} and the response holds a
+# {"result": ...} or {"error": ...} per call, in order
+@app.route("/batch", methods=["POST"])
+def batch():
+    body = request.get_json() or {}
+    columnar = request.args.get("format") == "columns"
+    fns = route_fns()
+    # each result is serialized on its own so its size is checked against
+    # its call's byte limit
+    parts = []
+    for call in body.get("calls", []):
+        fn_name = call.get("fn")
+        if fn_name not in fns:
+            parts.append(app.json.dumps({"error": f"No function: {fn_name}"}))
+            continue
+        try:
+            res = run_fn(fn_name, call.get("kwargs") or {})
+            if columnar:
+                res = to_columnar(res)
+            part = dumps_checked(fn_name, {"result": res})
+        except Exception as e:
+            part = app.json.dumps({"error": f"{type(e).__name__}: {e}"})
+        parts.append(part)
+    return Response("[" + ", ".join(parts) + "]", mimetype="application/json")
+
+@app.route("/stats/coalescing")
+def coalescing_stats():
+    return jsonify(single_flight.stats())
+
+@app.route("/stats/writes")
+def write_stats():
+    return jsonify(write_queue.stats())
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    info = job_manager.status(job_id)
+    if info is None:
+        return jsonify({"error": f"No job: {job_id}"}), 404
+    return jsonify(info)
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    info = job_manager.status(job_id)
+    if info is None:
+        return jsonify({"error": f"No job: {job_id}"}), 404
+    if info["status"] == "failed":
+        return jsonify(info), 500
+    if info["status"] != "done":
+        return jsonify(info), 202
+    result = job_manager.result(job_id)
+    if result is None:
+        # expired since the status check
+        return jsonify({"error": f"No job: {job_id}"}), 404
+    if isinstance(result, bytes):
+        return Response(result, mimetype="application/json")
+    # spilled results are streamed from disk rather than read into memory
+    return send_file(result, mimetype="application/json")
+
 # This function builds Flask endpoints for all non-private methods of the 
 # AeroDB class
 def build_routes(app):
     # For each method in AeroDB, create a Flask endpoint unless it's a 
     # private method
-    for fn_name in list_aerodb_fns():
+    for fn_name in route_fns():
         app.add_url_rule(
             f'/{fn_name}', 
             endpoint=fn_name, 
@@ -46,7 +237,13 @@ def build_routes(app):
             methods=["POST", "GET"]
         )
 
+# Loads everything the first request would otherwise wait for
+def prewarm():
+    db.warm()
+
 if __name__ == "__main__":
     app.debug = True
     build_routes(app)
+    if app.config['PREWARM']:
+        prewarm()
     app.run(port=5056, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import argparse
+import sqlite3
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+# measures cold start of the API and the dashboard: the time to import the
+# app module, to prewarm it (when enabled), and the first and second
+# request. Each run is a fresh interpreter so nothing is cached between runs.
+# --root measures another checkout, e.g. one from before a change:
+#   git worktree add /tmp/before <commit>
+#   python bench_startup.py --root /tmp/before --no-prewarm
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {app_dir!r})
+sys.path.insert(0, {db_dir!r})
+sys.path.insert(0, {client_dir!r})
+t0 = time.perf_counter()
+import {module} as app_module
+{setup}
+t1 = time.perf_counter()
+if {prewarm}:
+    app_module.prewarm()
+t2 = time.perf_counter()
+client = app_module.app.test_client()
+times = []
+for _ in range(2):
+    t = time.perf_counter()
+    resp = client.{method}({path!r}{body})
+    assert resp.status_code == 200, resp.status_code
+    times.append(time.perf_counter() - t)
+# both apps point sys.stdout at stderr, so write to the real stdout
+print(json.dumps({{
+    "import": t1 - t0, "prewarm": t2 - t1,
+    "first": times[0], "second": times[1],
+    "modules": sorted(m for m in ("pandas", "sqlalchemy", "requests", "duckdb")
+                      if m in sys.modules),
+}}), file=sys.__stdout__)
+"""
+
+APPS = {
+    "api": dict(
+        app_dir="api", module="api", method="post",
+        path="/clients", body=", json={}",
+        # point the app at the synthetic database and add the routes, as
+        # the __main__ block would
+        setup="from pathlib import Path\n"
+              "app_module.db.base = Path({base!r})\n"
+              "app_module.build_routes(app_module.app)",
+    ),
+    "dashboard": dict(
+        app_dir="dashboard", module="dashboard",
+        method="get", path="/home", body="", setup="",
+    ),
+}
+
+
+def build_db(base, n_clients=200):
+    conn = sqlite3.connect(os.path.join(base, "aerodb.db"))
+    conn.execute("CREATE TABLE clients (CLIENT_ID BIGINT PRIMARY KEY, CLIENT_NAME VARCHAR(50))")
+    conn.executemany("INSERT INTO clients VALUES (?, ?)",
+                     [(i, f"client-{i}") for i in range(n_clients)])
+    conn.commit()
+    conn.close()
+
+
+def probe(name, base, prewarm, root=ROOT):
+    spec = dict(APPS[name])
+    spec["setup"] = spec["setup"].format(base=base)
+    spec["app_dir"] = (Path(root) / spec["app_dir"]).as_posix()
+    code = PROBE.format(db_dir=(Path(root) / "db").as_posix(),
+                        client_dir=(Path(root) / "client").as_posix(),
+                        prewarm=prewarm, **spec)
+    out = subprocess.run([sys.executable, "-c", code], cwd=spec["app_dir"],
+                         capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{name} probe failed:\n{out.stderr}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs=5, root=ROOT, prewarm_runs=True):
+    with tempfile.TemporaryDirectory() as base:
+        build_db(base)
+        for name in APPS:
+            for prewarm in (False, True) if prewarm_runs else (False,):
+                results = [probe(name, base, prewarm, root) for _ in range(runs)]
+                med = {k: statistics.median(r[k] for r in results)
+                       for k in ("import", "prewarm", "first", "second")}
+                label = f"{name}{' prewarmed' if prewarm else ''}"
+                print(f"{label:20s} import {med['import'] * 1e3:7.1f} ms  "
+                      f"prewarm {med['prewarm'] * 1e3:7.1f} ms  "
+                      f"first {med['first'] * 1e3:7.1f} ms  "
+                      f"second {med['second'] * 1e3:6.1f} ms  "
+                      f"loaded by then: {', '.join(results[-1]['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API and dashboard cold start")
+    parser.add_argument("--root", default=ROOT.as_posix())
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-prewarm", action="store_true")
+    args = parser.parse_args()
+    main(args.runs, args.root, not args.no_prewarm)
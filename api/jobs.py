@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from guards import Budget
+
+# results larger than this are written to disk instead of kept in memory
+SPILL_BYTES = 8 * 1024 * 1024
+# finished jobs and their results are dropped after this many seconds
+RESULT_TTL = 60 * 60
+# serialized bytes collected before each write to the result
+WRITE_BYTES = 64 * 1024
+
+
+class Job:
+
+    def __init__(self, fn_name, kwargs):
+        self.id = uuid.uuid4().hex
+        self.fn_name = fn_name
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.size = None
+        self.body = None
+        self.path = None
+        self.budget = None
+        self.written = 0
+
+    def info(self):
+        now = time.time()
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or now) - self.started
+        return {
+            "job_id": self.id,
+            "fn": self.fn_name,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": elapsed,
+            "size": self.size,
+            # how far a running job has got: rows read and bytes serialized
+            "rows_done": self.budget.rows if self.budget is not None else 0,
+            "bytes_done": self.written,
+            "spilled": self.path is not None,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs AeroDB calls on a local worker pool so expensive requests don't
+    hold a Flask worker. Each job runs under its own execution budget.
+    Results are serialized incrementally, kept in memory while small and
+    written straight to a spill file once they pass spill_bytes, and are
+    kept until they expire or the manager is closed.
+
+    Parameters:
+    db (AeroDB): The database object the jobs call into.
+    workers (int): The number of worker threads.
+    run (callable, optional): Runs a call as run(fn_name, kwargs).
+        Defaults to calling the method on db directly.
+    limits (callable, optional): Returns the guards.Budget limits for a
+        method name. Defaults to no limits.
+    spill_dir (str, optional): Where large results are written. Defaults to
+        a temporary directory.
+    spill_bytes (int): Results larger than this are spilled to disk.
+    ttl (int): Seconds a finished job is kept.
+    """
+
+    def __init__(self, db, workers=2, run=None, limits=None, spill_dir=None,
+                 spill_bytes=SPILL_BYTES, ttl=RESULT_TTL):
+        self.db = db
+        self.run = run or (lambda fn_name, kwargs: getattr(db, fn_name)(**kwargs))
+        self.limits = limits or (lambda fn_name: {})
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aerodb-job")
+        # a directory made here is removed again by close()
+        self.own_dir = spill_dir is None
+        if spill_dir is None:
+            spill_dir = tempfile.mkdtemp(prefix="aerodb_jobs_")
+        os.makedirs(spill_dir, exist_ok=True)
+        self.spill_dir = spill_dir
+        self.spill_bytes = spill_bytes
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn_name, kwargs):
+        """
+        Queues an AeroDB method call.
+
+        Parameters:
+        fn_name (str): The name of the AeroDB method.
+        kwargs (dict): The arguments for the method.
+
+        Returns:
+        dict: The new job's status.
+        """
+        self.expire()
+        job = Job(fn_name, kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.pool.submit(self._run, job)
+        return job.info()
+
+    def _run(self, job):
+        job.status = "running"
+        job.started = time.time()
+        job.budget = Budget(job.fn_name, **self.limits(job.fn_name))
+        try:
+            with job.budget:
+                result = self.run(job.fn_name, job.kwargs)
+                self._serialize(job, result)
+            job.status = "done"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = "failed"
+            self._remove(job)
+        job.finished = time.time()
+
+    def _serialize(self, job, result):
+        # encode piece by piece, checking the job's byte and time budget as
+        # the output grows; past spill_bytes everything goes to the file
+        # rather than memory
+        buf = []
+        pending = 0
+        fp = None
+        try:
+            for piece in json.JSONEncoder(default=str).iterencode(result):
+                piece = piece.encode("utf-8")
+                buf.append(piece)
+                pending += len(piece)
+                if pending < WRITE_BYTES:
+                    continue
+                job.written += pending
+                pending = 0
+                job.budget.check_bytes(job.written)
+                job.budget.check_time()
+                if fp is None and job.written > self.spill_bytes:
+                    job.path = os.path.join(self.spill_dir, job.id + ".json")
+                    fp = open(job.path, "wb")
+                if fp is not None:
+                    fp.write(b"".join(buf))
+                    buf = []
+            job.written += pending
+            job.budget.check_bytes(job.written)
+            if fp is not None:
+                fp.write(b"".join(buf))
+            else:
+                job.body = b"".join(buf)
+            job.size = job.written
+        finally:
+            if fp is not None:
+                fp.close()
+
+    def _remove(self, job):
+        if job.path is not None and os.path.exists(job.path):
+            os.remove(job.path)
+
+    def get(self, job_id):
+        self.expire()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id):
+        """
+        Returns a job's status, or None if it is unknown or expired.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        return job.info()
+
+    def result(self, job_id):
+        """
+        Returns a finished job's serialized JSON result.
+
+        Parameters:
+        job_id (str): The job's ID.
+
+        Returns:
+        bytes, file or None: The result, a spilled result opened for reading
+        (the caller closes it), or None if the job isn't done.
+        """
+        self.expire()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "done":
+                return None
+            if job.path is not None:
+                # opened under the lock, so expire can't remove the file
+                # first; once open it stays readable after removal
+                return open(job.path, "rb")
+            return job.body
+
+    def expire(self):
+        # drop finished jobs older than the ttl, along with spilled files
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            old = [j for j in self.jobs.values()
+                   if j.finished is not None and j.finished < cutoff]
+            for job in old:
+                del self.jobs[job.id]
+        for job in old:
+            self._remove(job)
+
+    def close(self):
+        """
+        Stops the workers and deletes every spilled result, along with the
+        spill directory if the manager made it.
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+        for job in jobs:
+            self._remove(job)
+        if self.own_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,87 @@
+import json
+import threading
+
+
+def call_key(fn_name, kwargs):
+    """
+    Builds a canonical key for an AeroDB call, so identical requests map to
+    the same key regardless of argument order.
+
+    Parameters:
+    fn_name (str): The name of the AeroDB method.
+    kwargs (dict): The arguments for the method.
+
+    Returns:
+    str: The key.
+    """
+    return fn_name + ":" + json.dumps(kwargs, sort_keys=True, default=str)
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one execution: the first
+    caller for a key runs the function, callers arriving while it runs wait
+    and share its result (or its exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    def do(self, key, fn):
+        """
+        Runs fn once for all concurrent callers with the same key.
+
+        Parameters:
+        key (str): The call's key, see call_key.
+        fn (callable): The function to run, taking no arguments.
+
+        Returns:
+        The result of fn.
+        """
+        with self.lock:
+            self.calls += 1
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.inflight[key] = call
+                self.executions += 1
+            else:
+                call.waiters += 1
+                self.collapsed += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self.lock:
+                    del self.inflight[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "collapsed": self.collapsed,
+                "inflight": len(self.inflight),
+            }
@@ -0,0 +1,163 @@
+import sys
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+import pytest
+
+HERE = Path(__file__).resolve().parent
+sys.path[:0] = [HERE.as_posix(), (HERE.parent / "db").as_posix()]
+
+from aerodb import AeroDB
+from guards import BudgetExceeded
+from aggregates import rebuild_summaries
+from versioning import add_row_versions
+from writequeue import WriteQueue
+
+SCHEMA = """
+CREATE TABLE clients (CLIENT_ID BIGINT PRIMARY KEY, CLIENT_NAME VARCHAR(50));
+CREATE TABLE projects (PROJECT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_NAME VARCHAR(50), STAND_PERSISTENT_IDS TEXT);
+CREATE TABLE stands (STAND_PERSISTENT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    STAND_NAME VARCHAR(50), ACRES FLOAT);
+CREATE TABLE flights (FLIGHT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_ID BIGINT, STAND_PERSISTENT_ID BIGINT, FLIGHT_COMPLETE BOOLEAN);
+CREATE TABLE flight_ai (AI_FLIGHT_ID BIGINT PRIMARY KEY, AI_READY BOOLEAN,
+    AI_TPA FLOAT, QC_APPROVED BOOLEAN, FLIGHT_ID BIGINT);
+INSERT INTO clients VALUES (1, 'client');
+INSERT INTO projects VALUES (100, 1, 'project', '1000000');
+INSERT INTO stands VALUES (1000000, 1, 'stand', 10.0);
+INSERT INTO flights VALUES (10000000, 1, 100, 1000000, 0);
+INSERT INTO flights VALUES (10000001, 1, 100, 1000000, 0);
+INSERT INTO flight_ai VALUES (0, 1, 100.0, 0, 10000000);
+INSERT INTO flight_ai VALUES (1, 1, 120.0, 0, 10000001);
+"""
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    conn = sqlite3.connect((tmp_path / "aerodb.db").as_posix())
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    add_row_versions(conn)
+    tables = ["flights", "flight_ai", "stands", "projects"]
+    rows = [[dict(r) for r in conn.execute(f"SELECT * FROM {t}")] for t in tables]
+    rebuild_summaries(conn, *rows)
+    conn.close()
+    monkeypatch.setenv("AERODB_DIR", tmp_path.as_posix())
+    return AeroDB(dev=False)
+
+
+def row(db, table, id_col, uid):
+    return db.where_table_equal(table, id_col, uid, json_out=True)[0]
+
+
+def submit_together(queue, calls):
+    # submit from separate threads, in order, so the edits land in one batch
+    results = [None] * len(calls)
+
+    def run(i, kwargs):
+        try:
+            results[i] = queue.submit(kwargs)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, kw)) for i, kw in enumerate(calls)]
+    for t in threads:
+        t.start()
+        time.sleep(0.02)
+    for t in threads:
+        t.join()
+    return results
+
+
+def edit(table, orig, **changes):
+    return {"table": table, "orig_data": orig, "data": {**orig, **changes}}
+
+
+def test_failed_edit_does_not_fail_the_batch(db):
+    queue = WriteQueue(db, window=0.2)
+    flight = row(db, "flights", "FLIGHT_ID", 10000000)
+    project = row(db, "projects", "PROJECT_ID", 100)
+    # a stand list that isn't integers fails while computing the summaries
+    results = submit_together(queue, [
+        edit("flights", flight, FLIGHT_COMPLETE=1),
+        edit("projects", project, STAND_PERSISTENT_IDS="not,ids"),
+    ])
+    assert results[0]["status"] == "updated"
+    assert isinstance(results[1], ValueError)
+    assert queue.stats()["batches"] == 1
+    assert row(db, "flights", "FLIGHT_ID", 10000000)["FLIGHT_COMPLETE"] == 1
+    assert row(db, "projects", "PROJECT_ID", 100)["STAND_PERSISTENT_IDS"] == "1000000"
+    summary = db.client_summary([1])[0]
+    assert summary["FLIGHTS_COMPLETE"] == 1
+    assert summary["ACRES"] == 10.0
+
+
+def test_stale_edit_in_the_same_batch_conflicts(db):
+    queue = WriteQueue(db, window=0.2)
+    flight = row(db, "flights", "FLIGHT_ID", 10000000)
+    # both edits were made against version 0, only one of them can apply
+    results = submit_together(queue, [
+        edit("flights", flight, FLIGHT_COMPLETE=1),
+        edit("flights", flight, PROJECT_ID=-1),
+    ])
+    assert sorted(r["status"] for r in results) == ["conflict", "updated"]
+    assert queue.stats()["batches"] == 1
+    current = row(db, "flights", "FLIGHT_ID", 10000000)
+    assert current["ROW_VERSION"] == 1
+    conflict = [r for r in results if r["status"] == "conflict"][0]
+    assert conflict["row"] == current
+
+
+def test_lost_transaction_rewrites_earlier_edits(db, monkeypatch):
+    queue = WriteQueue(db, window=0.2)
+    apply_update = db.apply_update
+
+    def failing(conn, e):
+        if e["uid"] == 1:
+            # what sqlite does to the transaction after an interrupt
+            conn.execute("ROLLBACK")
+            raise sqlite3.OperationalError("interrupted")
+        return apply_update(conn, e)
+
+    monkeypatch.setattr(db, "apply_update", failing)
+    flight = row(db, "flights", "FLIGHT_ID", 10000000)
+    ai = row(db, "flight_ai", "AI_FLIGHT_ID", 1)
+    results = submit_together(queue, [
+        edit("flights", flight, FLIGHT_COMPLETE=1),
+        edit("flight_ai", ai, QC_APPROVED=1),
+    ])
+    assert results[0]["status"] == "updated"
+    assert isinstance(results[1], sqlite3.OperationalError)
+    assert row(db, "flights", "FLIGHT_ID", 10000000)["FLIGHT_COMPLETE"] == 1
+    assert db.client_summary([1])[0]["FLIGHTS_COMPLETE"] == 1
+    assert db.client_summary([1])[0]["QC_APPROVED"] == 0
+
+
+def test_budget_applies_per_edit(db, monkeypatch):
+    queue = WriteQueue(db, window=0.2, limits={"seconds": 0.1})
+    apply_update = db.apply_update
+
+    def slow(conn, e):
+        if e["uid"] == 1:
+            conn.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+                "SELECT count(*) FROM n").fetchall()
+        return apply_update(conn, e)
+
+    monkeypatch.setattr(db, "apply_update", slow)
+    flight = row(db, "flights", "FLIGHT_ID", 10000000)
+    ai = row(db, "flight_ai", "AI_FLIGHT_ID", 1)
+    other = row(db, "flights", "FLIGHT_ID", 10000001)
+    results = submit_together(queue, [
+        edit("flights", flight, FLIGHT_COMPLETE=1),
+        edit("flight_ai", ai, QC_APPROVED=1),
+        edit("flights", other, FLIGHT_COMPLETE=1),
+    ])
+    assert results[0]["status"] == "updated"
+    assert isinstance(results[1], BudgetExceeded)
+    assert results[2]["status"] == "updated"
+    assert db.client_summary([1])[0]["FLIGHTS_COMPLETE"] == 2
+    assert db.client_summary([1])[0]["QC_APPROVED"] == 0
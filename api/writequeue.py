@@ -0,0 +1,198 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from guards import Budget, watch, unwatch
+
+# seconds the writer waits for more edits after the first of a batch
+WINDOW = 0.005
+# the most edits committed in one transaction
+MAX_BATCH = 100
+
+
+class WriteQueue:
+    """
+    Funnels AeroDB updates through a single writer thread that commits
+    whatever is pending in one transaction per short window (group commit),
+    instead of one connection, transaction and fsync per edit. Each caller
+    blocks until its own edit is committed and gets its own result.
+
+    Each edit, with its change to the summary tables, runs under its own
+    savepoint and execution budget, so an edit that fails or runs out of
+    time is rolled back and reported to its caller alone. Results are only
+    handed out once the transaction holding them has committed.
+
+    Parameters:
+    db (AeroDB): The database object the edits are written through.
+    window (float): Seconds to wait for more edits before committing.
+    max_batch (int): The most edits per transaction.
+    limits (dict, optional): Budget limits for one edit, see guards.Budget.
+    """
+
+    def __init__(self, db, window=WINDOW, max_batch=MAX_BATCH, limits=None):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self.limits = limits or {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.failed = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+        self.last_commit_seconds = None
+        self.max_commit_seconds = 0.0
+        self.thread = threading.Thread(target=self._run, name="aerodb-write-queue", daemon=True)
+        self.thread.start()
+
+    def submit(self, kwargs):
+        """
+        Queues an update and waits for it to be committed.
+
+        Parameters:
+        kwargs (dict): The arguments for AeroDB.update.
+
+        Returns:
+        dict: The same result AeroDB.update returns.
+        """
+        future = Future()
+        self.queue.put((kwargs, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                # only reached when a transaction couldn't be opened; its
+                # edits were not written
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _write(self, batch):
+        conn = None
+        shards = None
+        moved = False
+        pending = []
+        started = None
+        try:
+            for kwargs, future in batch:
+                # routing reads committed state, so commit a move between
+                # shards before working out the next edit
+                if conn is not None and moved:
+                    self._commit(conn, pending, started)
+                    conn = None
+                kw = dict(kwargs)
+                kw.pop("json_out", None)
+                try:
+                    edit = self.db.prepare_update(kw.get("table"), kw.get("orig_data"), kw.get("data"))
+                except Exception as e:
+                    future.set_exception(e)
+                    continue
+                if edit is None:
+                    future.set_result({"status": "unchanged", "row": None})
+                    continue
+                # one transaction per run of edits on the same shards, which is
+                # the whole batch unless sharded
+                if conn is not None and edit["shards"] != shards:
+                    self._commit(conn, pending, started)
+                    conn = None
+                if conn is None:
+                    started = time.perf_counter()
+                    shards = edit["shards"]
+                    moved = False
+                    conn = self.db.write_con(shards)
+                    conn.execute("BEGIN IMMEDIATE")
+                conn.execute("SAVEPOINT edit")
+                try:
+                    with Budget("update", **self.limits):
+                        watch(conn)
+                        result = self.db.apply_update(conn, edit)
+                except Exception as e:
+                    unwatch(conn)
+                    with self.lock:
+                        self.failed += 1
+                    future.set_exception(e)
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK TO edit")
+                        conn.execute("RELEASE edit")
+                        continue
+                    # sqlite rolls back the whole transaction on some errors,
+                    # e.g. an interrupted statement, so write the edits
+                    # before this one again
+                    conn.close()
+                    conn = None
+                    retry = [(kw, f) for kw, _, f in pending]
+                    pending.clear()
+                    self._write(retry)
+                    continue
+                unwatch(conn)
+                conn.execute("RELEASE edit")
+                moved = moved or edit["move_to"] is not None
+                pending.append((kwargs, result, future))
+            if conn is not None:
+                self._commit(conn, pending, started)
+        except Exception:
+            # closing without a commit rolls back the pending edits, which
+            # _run then fails
+            if conn is not None:
+                conn.close()
+            raise
+
+    def _commit(self, conn, pending, started):
+        try:
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            with self.lock:
+                self.failed_batches += 1
+            for _, _, future in pending:
+                future.set_exception(e)
+        else:
+            self._record(len(pending), time.perf_counter() - started)
+            for _, result, future in pending:
+                future.set_result(result)
+        finally:
+            conn.close()
+            pending.clear()
+
+    def _record(self, writes, elapsed):
+        with self.lock:
+            self.writes += writes
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, writes)
+            self.commit_seconds += elapsed
+            self.last_commit_seconds = elapsed
+            self.max_commit_seconds = max(self.max_commit_seconds, elapsed)
+
+    def stats(self):
+        with self.lock:
+            mean = self.commit_seconds / self.batches if self.batches else None
+            return {
+                "depth": self.queue.qsize(),
+                "writes": self.writes,
+                "failed_writes": self.failed,
+                "batches": self.batches,
+                "failed_batches": self.failed_batches,
+                "largest_batch": self.largest_batch,
+                "mean_batch": self.writes / self.batches if self.batches else None,
+                "commit_seconds": {
+                    "last": self.last_commit_seconds,
+                    "mean": mean,
+                    "max": self.max_commit_seconds,
+                },
+            }
@@ -0,0 +1,303 @@
+import json
+import time
+import threading
+
+DEFAULT_URL = "http://127.0.0.1:5056"
+# the most response bytes the result cache holds
+MAX_CACHE_BYTES = 64 * 2**20
+# with auto_batch, seconds the first of several concurrent calls waits for
+# others to join its batch
+BATCH_WINDOW = 0.005
+
+
+def call_key(fn_name, kwargs):
+    return fn_name + ":" + json.dumps(kwargs, sort_keys=True, default=str)
+
+
+def from_columnar(data):
+    """
+    Decodes a columnar API result into DataFrames.
+
+    Parameters:
+    data (dict): {"columns": [...], "rows": [...]}, or a dict of those for
+        grouped results.
+
+    Returns:
+    pandas.DataFrame or dict: A DataFrame, or a dict of DataFrames.
+    """
+    import pandas as pd
+    if "columns" in data and "rows" in data:
+        return pd.DataFrame(data["rows"], columns=data["columns"])
+    return {k: from_columnar(v) for k, v in data.items()}
+
+
+class Pending:
+    """
+    The result of a call made inside a batch, available once the batch has
+    been sent.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def result(self):
+        if not self.done:
+            raise RuntimeError("The batch has not been sent yet")
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.value
+
+
+class Batch:
+
+    def __init__(self, client, as_frame):
+        self.client = client
+        self.as_frame = as_frame
+        self.calls = []
+
+    def __getattr__(self, fn_name):
+        if fn_name not in self.client.fns:
+            raise AttributeError(fn_name)
+        def call(**kwargs):
+            pending = Pending()
+            self.calls.append((fn_name, kwargs, pending))
+            return pending
+        return call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
+
+    def send(self):
+        if len(self.calls) == 0:
+            return
+        body = {"calls": [{"fn": f, "kwargs": kw} for f, kw, _ in self.calls]}
+        params = {"format": "columns"} if self.as_frame else {}
+        resp = self.client.session.post(
+            self.client.url("batch"), json=body, params=params,
+            timeout=self.client.timeout)
+        resp.raise_for_status()
+        for (_, _, pending), res in zip(self.calls, resp.json()):
+            pending.error = res.get("error")
+            value = res.get("result")
+            if self.as_frame and value is not None:
+                value = from_columnar(value)
+            pending.value = value
+            pending.done = True
+        self.calls = []
+
+
+class AutoBatcher:
+    """
+    Groups calls issued together from several threads into one /batch
+    request. The first caller waits window seconds for others, then sends
+    every call queued meanwhile and hands each caller its result. A call
+    that no other joined is made on its own, through the ETag cache.
+
+    Parameters:
+    client (AeroDBClient): The client sending the requests.
+    window (float): Seconds the first caller waits for others.
+    max_batch (int): The most calls per request.
+    """
+
+    def __init__(self, client, window=BATCH_WINDOW, max_batch=50):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.queued = []
+        self.leading = False
+
+    def call(self, fn_name, kwargs, as_frame):
+        entry = (fn_name, kwargs, as_frame, Pending(), threading.Event())
+        with self.lock:
+            self.queued.append(entry)
+            lead = not self.leading
+            self.leading = True
+        if not lead:
+            entry[4].wait()
+            return entry[3].result()
+        time.sleep(self.window)
+        with self.lock:
+            calls, self.queued = self.queued, []
+            self.leading = False
+        if len(calls) == 1:
+            return self.client._call(fn_name, kwargs, as_frame)
+        try:
+            self._send(calls)
+        finally:
+            for _, _, _, pending, done in calls:
+                done.set()
+        return entry[3].result()
+
+    def _send(self, calls):
+        # /batch decodes every call of a request the same way
+        for as_frame in (False, True):
+            group = [c for c in calls if c[2] == as_frame]
+            for i in range(0, len(group), self.max_batch):
+                batch = Batch(self.client, as_frame)
+                batch.calls = [(f, kw, p) for f, kw, _, p, _ in group[i:i + self.max_batch]]
+                try:
+                    batch.send()
+                except Exception as e:
+                    for _, _, pending in batch.calls:
+                        pending.error = f"{type(e).__name__}: {e}"
+                        pending.done = True
+
+
+class AeroDBClient:
+    """
+    A client for the AeroDB API. Every public AeroDB method listed by the
+    API's /manifest is available as a method taking the same keyword
+    arguments, e.g. client.flight_full_data(flight_ids=[10000001]).
+
+    Requests go through one pooled keep-alive session. Results are cached
+    locally with their ETag and revalidated with If-None-Match, so unchanged
+    results are not downloaded again. The least recently used results are
+    dropped once the cache holds max_cache_entries results or
+    max_cache_bytes of response bodies.
+
+    Calls made inside a batch() block are sent as one request. With
+    auto_batch, calls issued together from several threads (e.g. the
+    dashboard's request handlers) are also grouped, see AutoBatcher;
+    grouped calls bypass the result cache, as /batch sends no ETags.
+
+    Parameters:
+    base_url (str): The API's address.
+    pool_size (int): The number of keep-alive connections to keep.
+    cache (bool): If True, caches results and revalidates them by ETag.
+    max_cache_entries (int): The most results kept in the cache.
+    max_cache_bytes (int): The most response bytes kept in the cache. A
+        larger result is not cached.
+    timeout (float): Seconds to wait for a response.
+    auto_batch (bool): If True, groups concurrent calls into /batch requests.
+    batch_window (float): With auto_batch, seconds to wait for more calls.
+    """
+
+    def __init__(self, base_url=DEFAULT_URL, pool_size=10, cache=True,
+                 max_cache_entries=256, max_cache_bytes=MAX_CACHE_BYTES,
+                 timeout=600, auto_batch=False, batch_window=BATCH_WINDOW):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.cache_enabled = cache
+        self.max_cache_entries = max_cache_entries
+        self.max_cache_bytes = max_cache_bytes
+        self.cache = {}
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+        self._fns = None
+        self.batcher = AutoBatcher(self, batch_window) if auto_batch else None
+
+    def url(self, endpoint):
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+
+    @property
+    def fns(self):
+        # the method surface comes from the server's list_aerodb_fns()
+        if self._fns is None:
+            resp = self.session.get(self.url("manifest"), timeout=self.timeout)
+            resp.raise_for_status()
+            self._fns = resp.json()["fns"]
+        return self._fns
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.fns)
+
+    def __getattr__(self, fn_name):
+        if fn_name.startswith("_") or fn_name not in self.fns:
+            raise AttributeError(fn_name)
+        def call(as_frame=False, **kwargs):
+            return self.call(fn_name, kwargs, as_frame=as_frame)
+        call.__name__ = fn_name
+        return call
+
+    def call(self, fn_name, kwargs=None, as_frame=False):
+        """
+        Calls an AeroDB method through the API.
+
+        Parameters:
+        fn_name (str): The name of the AeroDB method.
+        kwargs (dict, optional): The arguments for the method.
+        as_frame (bool): If True, fetches the result in columnar form and
+            returns a DataFrame (or a dict of DataFrames for grouped results).
+
+        Returns:
+        The method's JSON result, or DataFrames with as_frame.
+        """
+        kwargs = kwargs or {}
+        if self.batcher is not None:
+            return self.batcher.call(fn_name, kwargs, as_frame)
+        return self._call(fn_name, kwargs, as_frame)
+
+    def _call(self, fn_name, kwargs, as_frame=False):
+        params = {"format": "columns"} if as_frame else {}
+        key = call_key(fn_name, kwargs) + str(as_frame)
+        headers = {}
+        cached = None
+        if self.cache_enabled:
+            with self.lock:
+                cached = self.cache.get(key)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+        resp = self.session.post(self.url(fn_name), json=kwargs, params=params,
+                                 headers=headers, timeout=self.timeout)
+        if resp.status_code == 304 and cached is not None:
+            data = cached[1]
+            with self.lock:
+                # move it to the most recently used end
+                if self.cache.get(key) is cached:
+                    self.cache[key] = self.cache.pop(key)
+        else:
+            resp.raise_for_status()
+            data = resp.json()
+            etag = resp.headers.get("ETag")
+            if self.cache_enabled and etag is not None:
+                self._store(key, etag, data, len(resp.content))
+        if as_frame:
+            return from_columnar(data)
+        return data
+
+    def _store(self, key, etag, data, size):
+        with self.lock:
+            old = self.cache.pop(key, None)
+            if old is not None:
+                self.cache_bytes -= old[2]
+            if size > self.max_cache_bytes:
+                return
+            self.cache[key] = (etag, data, size)
+            self.cache_bytes += size
+            while (len(self.cache) > self.max_cache_entries
+                   or self.cache_bytes > self.max_cache_bytes):
+                self.cache_bytes -= self.cache.pop(next(iter(self.cache)))[2]
+
+    def batch(self, as_frame=False):
+        """
+        Groups calls into one request. Calls made on the batch return
+        Pending objects whose result() is available after the with block:
+
+            with client.batch() as b:
+                clients = b.clients()
+                flights = b.flights(flight_ids=[10000001])
+            clients.result()
+
+        Parameters:
+        as_frame (bool): If True, results are decoded into DataFrames.
+
+        Returns:
+        Batch: The batch.
+        """
+        return Batch(self, as_frame)
+
+    def close(self):
+        self.session.close()
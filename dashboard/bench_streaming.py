@@ -0,0 +1,67 @@
+import sys
+import json
+import time
+import tracemalloc
+from pathlib import Path
+from flask import render_template
+
+# the dashboard imports the db and client modules from the install path, so
+# point it at the ones next to this checkout
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [(ROOT / "db").as_posix(), (ROOT / "client").as_posix()]
+
+from dashboard import app, to_tables, stream_page
+
+# compares rendering a large synthetic grouped view with render_template
+# against the streamed path used by the view route. The view's data is
+# decoded from JSON first, as the API client does, and stays in memory
+# while either path renders it; streaming only avoids building the whole
+# HTML document.
+
+
+def synthetic_view(n_groups=50, rows_per_group=400, n_cols=40):
+    view = {}
+    for g in range(n_groups):
+        view[g] = [
+            {f"COL_{c}": f"value-{g}-{r}-{c}" for c in range(n_cols)}
+            for r in range(rows_per_group)
+        ]
+    return view
+
+
+def measure(render):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    ttfb = None
+    total = 0
+    for chunk in render():
+        if ttfb is None:
+            ttfb = time.perf_counter() - t0
+        total += len(chunk)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ttfb, elapsed, peak, total
+
+
+def main(n_groups=50, rows_per_group=400):
+    body = json.dumps(synthetic_view(n_groups, rows_per_group))
+    tracemalloc.start()
+    data = json.loads(body)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'decoded data':16s} held={held/2**20:7.1f}MiB json={len(body)/2**20:6.1f}MiB")
+    tables, column_names = to_tables("bench", data)
+    context = dict(tables=tables, table="bench", column_names=column_names,
+                   presets={}, editable=False)
+    with app.test_request_context():
+        full = lambda: [render_template("datatables.html", **context)]
+        streamed = lambda: stream_page("datatables.html", **context).response
+        for name, render in [("render_template", full), ("stream_page", streamed)]:
+            ttfb, elapsed, peak, total = measure(render)
+            print(f"{name:16s} ttfb={ttfb*1000:8.1f}ms total={elapsed*1000:8.1f}ms "
+                  f"peak={peak/2**20:7.1f}MiB html={total/2**20:6.1f}MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,40 @@
-from flask import Flask, render_template, jsonify, redirect, url_for, request, session
+from flask import (Flask, render_template, jsonify, redirect, url_for, request, session,
+                   Response, stream_with_context)
 from flask_cors import CORS
-import requests
 from datetime import datetime
 import json
-import pandas as pd
+import os
 import sys
 sys.stdout = sys.stderr
 sys.path.append("/home/aerotract/software/aerotract_db/db")
-from aerodb import list_aerodb_fns
+from manifest import route_fns
+from compression import install_compression
+from profiling import install_profiling
+sys.path.append("/home/aerotract/software/aerotract_db/client")
+from aerodb_client import AeroDBClient
+
+# rendered HTML is sent in chunks of roughly this many characters
+STREAM_BUFFER = 64 * 1024
 
 def api_url(endpoint):
     endpoint = endpoint.lstrip("/")
     return f"http://127.0.0.1:5056/{endpoint}"
 
+# one pooled, caching client shared by every view, created on first use
+_api = None
+
+def get_client():
+    global _api
+    if _api is None:
+        _api = AeroDBClient(api_url(""))
+    return _api
+
 def get_api(endpoint):
-    url = api_url(endpoint)
-    return lambda: requests.get(url)
+    return lambda **kw: get_client().call(endpoint, kw)
 
 def get_fns_for(prefix):
     fn_names = []
-    for fn_name in list_aerodb_fns():
+    for fn_name in route_fns():
         if not fn_name.startswith(prefix):
             continue
         fn_names.append(fn_name)
@@ -30,6 +45,7 @@ def load_schema():
         return json.loads(fp.read())
     
 def to_dataframe(data):
+    import pandas as pd
     _df = lambda x: pd.DataFrame(x).to_html()
     if isinstance(data, dict):
         return {k: _df(v) for k,v in data.items()}
@@ -52,10 +68,34 @@ def to_tables(search, data):
             column_names.add(cn)
     return tables, list(column_names)
 
+def stream_page(template_name, **context):
+    # render a template lazily and send it in buffered chunks, so the first
+    # bytes go out before the rest of the document is built and the whole
+    # HTML is never held at once; the context (the API data) still is
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    def generate():
+        buf, size = [], 0
+        for chunk in template.generate(**context):
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= STREAM_BUFFER:
+                yield "".join(buf)
+                buf, size = [], 0
+        if len(buf) > 0:
+            yield "".join(buf)
+    return Response(stream_with_context(generate()), mimetype="text/html")
+
 app = Flask(__name__, template_folder="./templates")
 CORS(app)
 
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
+app.config['COMPRESS_MIN_SIZE'] = 1024
+# open the API client and compile the templates before serving, see prewarm()
+app.config['PREWARM'] = os.getenv("AERODB_PREWARM") == "1"
+install_compression(app)
+# opt-in per request profiling, enabled with AERODB_PROFILING=1
+install_profiling(app)
 
 @app.after_request
 def add_header(response):
@@ -87,18 +127,36 @@ def browse():
 @app.route('/view/<search_group>/<api_endpoint>', methods=['POST'])
 def view(search_group, api_endpoint):
     api_call = get_api(api_endpoint)
-    data = api_call().json()
     schema = load_schema()
-    desc = schema[search_group]["functions"][api_endpoint]["description"]
-    presets = schema[search_group]["functions"][api_endpoint].get("selection_groups", {})
-    editable = schema[search_group]["functions"][api_endpoint].get("editable", False)
+    function = schema[search_group]["functions"][api_endpoint]
+    desc = function["description"]
+    presets = function.get("selection_groups", {})
+    editable = function.get("editable", False)
+    # a chosen preset is sent along so only its columns are read
+    preset = request.values.get("preset")
+    if preset in presets and "cols" in function.get("form", {}):
+        data = api_call(cols=presets[preset])
+    else:
+        data = api_call()
     data, column_names = to_tables(desc, data)
     for preset_name, columns in presets.items():
         presets[preset_name] = ",".join(columns)
-    return render_template("datatables.html", tables=data, table=api_endpoint,
-                           column_names=column_names, presets=presets, editable=editable)
+    return stream_page("datatables.html", tables=data, table=api_endpoint,
+                       column_names=column_names, presets=presets, editable=editable)
+
 
+# Loads everything the first request would otherwise wait for
+def prewarm():
+    try:
+        get_client().fns
+    except Exception as e:
+        # the API may still be starting, the first view will connect then
+        print(f"Could not reach the API to prewarm: {e}")
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
 
 if __name__ == "__main__":
     app.debug = True
+    if app.config['PREWARM']:
+        prewarm()
     app.run(port=5055, host="0.0.0.0")
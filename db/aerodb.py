@@ -1,24 +1,56 @@
 import sqlite3
-import pandas as pd
 import os
 from pathlib import Path
-from sqlalchemy import create_engine
 import json
 import sys
+import threading
+from lazy import lazy_import
+from dtypes import declared_types, compact_frame, plain_records
+import aggregates
+from guards import watch, count_rows, row_limited, fetch_counted, FETCH_ROWS
+import analytics
+from versioning import (VERSION_COL, VERSIONED_TABLES, add_row_versions,
+                        conditional_update)
+from sharding import (SHARD_TABLES, shard_name, list_shards, query_table,
+                      federated_query, move_flight)
+
+# pandas is loaded by the first query that needs it, and SQLAlchemy only by
+# engine(), which just the ingestion scripts use
+pd = lazy_import("pandas")
 
 
 class AeroDB:
 
-    def __init__(self, dev=True):
+    def __init__(self, dev=True, compact_dtypes=False, arrow_strings=False,
+                 shard_by=None):
         """
         Initializes an AeroDB object. Sets the base path for SQLite databases.
 
         Parameters:
         dev (bool): If True, uses a sandbox path for development purposes.
+        compact_dtypes (bool): If True, DataFrame results use compact dtypes
+            derived from the declared table schema (nullable booleans,
+            downcast ints, categoricals). JSON results are unaffected.
+        arrow_strings (bool): If True with compact_dtypes, string columns
+            that aren't categorical use Arrow-backed storage.
+        shard_by (str, optional): If "client", the flight-side tables are read
+            from per-client shard files (see sharding.split_into_shards).
         """
+        if shard_by not in (None, "client"):
+            raise ValueError(f"Unsupported shard_by: {shard_by}")
         base = os.getenv(
             "AERODB_DIR") if not dev else "/home/aerotract/.sandbox"
         self.base = Path(base)
+        self.compact_dtypes = compact_dtypes
+        self.arrow_strings = arrow_strings
+        self.shard_by = shard_by
+        self.snapshot_dir = Path(os.getenv(
+            "AERODB_SNAPSHOTS", (self.base / "snapshots").as_posix()))
+        self._analytics = None
+        self._analytics_lock = threading.Lock()
+        self._column_types = None
+        self._table_columns = {}
+        self._columns_stamp = None
 
     # general helper functions
 
@@ -34,7 +66,8 @@ class AeroDB:
         """
         db = db + ".db"
         path = (self.base / db).as_posix()
-        return sqlite3.connect(path)
+        # honour the execution budget of the API call, if there is one
+        return watch(sqlite3.connect(path))
 
     def engine(self, db="aerodb"):
         """
@@ -46,18 +79,68 @@ class AeroDB:
         Returns:
         sqlalchemy.engine.Engine: An SQLAlchemy engine object.
         """
+        from sqlalchemy import create_engine
         db = db + ".db"
         path = (self.base / db).as_posix()
         path = "sqlite:///" + path
         return create_engine(path)
 
+    def column_types(self):
+        """
+        Returns the type family of every column in the database, read once
+        from the declared table schema.
+
+        Returns:
+        dict: A dictionary mapping column names to type families.
+        """
+        if self._column_types is None:
+            types = {}
+            dbs = ["aerodb"]
+            if self.shard_by is not None:
+                dbs.extend(list_shards(self.base)[:1])
+            for db in dbs:
+                conn = self.con(db)
+                types = {**declared_types(conn), **types}
+                conn.close()
+            self._column_types = types
+        return self._column_types
+
+    def warm(self):
+        """
+        Loads pandas and the per-table column caches, so the first request
+        after a start doesn't pay for them.
+        """
+        pd.DataFrame
+        for table in self.list_tables():
+            self.table_columns(table)
+        if self.compact_dtypes:
+            self.column_types()
+
+    def compact(self, df):
+        if not self.compact_dtypes:
+            return df
+        return compact_frame(df, self.column_types(),
+                             arrow_strings=self.arrow_strings)
+
+    def records(self, df):
+        # to_dict("records") for results that may hold compact dtypes, whose
+        # missing values can't be sent as JSON
+        if not self.compact_dtypes:
+            return df.to_dict("records")
+        return plain_records(df)
+
     def handle_output(self, data, json_out=False):
+        # records are returned as they are, without loading pandas to check
+        if json_out and isinstance(data, (list, dict)):
+            return data
         if json_out and isinstance(data, pd.DataFrame):
-            data = data.to_dict("records")
+            data = self.records(data)
         elif not json_out and isinstance(data, dict):
-            data = {k: pd.DataFrame(v) for k, v in data.items()}
+            data = {k: self.compact(pd.DataFrame(v)) for k, v in data.items()}
         elif not json_out and isinstance(data, list):
-            data = pd.DataFrame(data)
+            data = self.compact(pd.DataFrame(data))
+        elif not json_out and isinstance(data, pd.DataFrame):
+            data = self.compact(data)
         return data
 
     # query helper functions
@@ -82,12 +165,84 @@ class AeroDB:
         Returns:
         pandas.DataFrame: The requested table in DataFrame format.
         """
-        conn = self.con()
         query = f"SELECT * FROM {name}"
-        data = pd.read_sql(query, conn)
-        return self.handle_output(data, json_out)
+        return self.execute_query(query, json_out=json_out)
 
-    def execute_query(self, query=None, params=None, json_out=True):
+    def route(self, table, search=None, match=None):
+        """
+        Returns the shards a lookup on a flight-side table has to read.
+
+        Parameters:
+        table (str): The name of the table.
+        search (str, optional): The column being matched.
+        match (optional): The value or list of values being matched.
+
+        Returns:
+        list or None: The shard database names, or None when the table is
+        not sharded.
+        """
+        if self.shard_by is None or table not in SHARD_TABLES:
+            return None
+        shards = list_shards(self.base)
+        if match is None:
+            return shards
+        if not isinstance(match, list):
+            match = [match]
+        if search == "CLIENT_ID":
+            client_ids = match
+        elif search == "FLIGHT_ID":
+            plc = ", ".join(["?"] * len(match))
+            client_ids = [r["CLIENT_ID"] for r in self.fetch_records(
+                f"SELECT DISTINCT CLIENT_ID FROM flight_shards WHERE FLIGHT_ID in ({plc})",
+                match)]
+        else:
+            return shards
+        wanted = set(shard_name(c) for c in client_ids)
+        return [s for s in shards if s in wanted]
+
+    def locate(self, table, id_col, uid):
+        """
+        Returns the shard holding a row of a flight-side table, found by the
+        row's own ID.
+
+        Parameters:
+        table (str): The name of the table.
+        id_col (str): The table's ID column.
+        uid: The ID of the row.
+
+        Returns:
+        str or None: The shard database name, or None if no shard has it.
+        """
+        flight_id = uid
+        if table != "flights":
+            rows = self.execute_query(
+                f"SELECT FLIGHT_ID FROM {table} WHERE {id_col} = ?", (uid,),
+                json_out=True)
+            if len(rows) == 0:
+                return None
+            flight_id = rows[0]["FLIGHT_ID"]
+        shards = self.route("flights", "FLIGHT_ID", flight_id)
+        return shards[0] if shards else None
+
+    def write_con(self, shards=()):
+        """
+        Opens a connection for writes: to the main database, with the given
+        shards attached under their names so one transaction can span them.
+
+        Parameters:
+        shards (list): The shard database names to attach.
+
+        Returns:
+        sqlite3.Connection: The connection, with sqlite3.Row as row factory.
+        """
+        conn = self.con()
+        conn.row_factory = sqlite3.Row
+        for shard in shards:
+            path = (self.base / (shard + ".db")).as_posix()
+            conn.execute(f"ATTACH DATABASE ? AS {shard}", (path,))
+        return conn
+
+    def execute_query(self, query=None, params=None, json_out=True, shards=None):
         """
         Executes a query on the SQLite database.
 
@@ -95,18 +250,74 @@ class AeroDB:
         query (str): The SQL query to execute.
         params (dict): The parameters for the SQL query.
         json (bool): If True, returns data as a list of dictionaries.
+        shards (list, optional): When sharded, the shards to read. If None,
+            queries on flight-side tables read every shard.
 
         Returns:
         pandas.DataFrame or list of dict: The result of the SQL query.
         """
-        conn = self.con()
         if query is None:
             query = f"SELECT * FROM clients;"
-        data = pd.read_sql(query, conn, params=params)
+        table = query_table(query)
+        if self.shard_by is not None and table in SHARD_TABLES:
+            if shards is None:
+                shards = self.route(table)
+            columns, rows = federated_query(
+                self.base, query, params, shards, table)
+            if json_out:
+                return [dict(zip(columns, row)) for row in rows]
+            data = pd.DataFrame.from_records(rows, columns=columns)
+            return self.handle_output(data, json_out)
+        if json_out:
+            # records are wanted, so skip building a DataFrame
+            return self.fetch_records(query, params)
+        conn = self.con()
+        try:
+            if row_limited():
+                # read in chunks so an oversized result fails before it is
+                # fully loaded
+                chunks = []
+                for chunk in pd.read_sql(query, conn, params=params, chunksize=FETCH_ROWS):
+                    count_rows(len(chunk))
+                    chunks.append(chunk)
+                if len(chunks) == 0:
+                    data = pd.read_sql(query, conn, params=params)
+                elif len(chunks) == 1:
+                    data = chunks[0]
+                else:
+                    data = pd.concat(chunks, ignore_index=True)
+            else:
+                data = pd.read_sql(query, conn, params=params)
+        finally:
+            conn.close()
         return self.handle_output(data, json_out)
 
-    def get_columns(self, table):
+    def fetch_records(self, query, params=None):
+        """
+        Executes a query at the cursor level and returns plain dictionaries,
+        without going through pandas. Used for point and small IN lookups.
+
+        Parameters:
+        query (str): The SQL query to execute.
+        params (dict or sequence, optional): The parameters for the query.
+
+        Returns:
+        list of dict: One dictionary per row.
+        """
         conn = self.con()
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = fetch_counted(conn.execute(query, params or ()))
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+    def get_columns(self, table):
+        db = "aerodb"
+        shards = self.route(table)
+        if shards:
+            db = shards[0]
+        conn = self.con(db)
         cursor = conn.cursor()
         query = f"PRAGMA table_info({table})"
         cursor.execute(query)
@@ -115,6 +326,48 @@ class AeroDB:
         conn.close()
         return columns
 
+    def table_columns(self, table):
+        """
+        Returns the column names of a table, cached until the main database
+        file changes. Rebuilding or resharding tables always writes to it.
+
+        Parameters:
+        table (str): The name of the table.
+
+        Returns:
+        list: The column names.
+        """
+        stamp = os.stat(self.base / "aerodb.db").st_mtime_ns
+        columns = self._table_columns
+        if stamp != self._columns_stamp:
+            columns = {}
+            self._table_columns = columns
+            self._columns_stamp = stamp
+        if table not in columns:
+            columns[table] = self.get_columns(table)
+        return columns[table]
+
+    def select_cols(self, table, cols=None, keys=[]):
+        """
+        Returns the columns to read from a table for a set of requested
+        columns, plus the keys needed to join it.
+
+        Parameters:
+        table (str): The name of the table.
+        cols (list, optional): The requested columns. If None, all columns.
+        keys (list): Join keys to add when the table is read.
+
+        Returns:
+        str or list: "*" if cols is None, otherwise the columns to select,
+        or an empty list if the table holds none of the requested columns.
+        """
+        if cols is None or len(cols) == 0:
+            return "*"
+        wanted = [c for c in self.table_columns(table) if c in cols]
+        if len(wanted) == 0:
+            return []
+        return wanted + [k for k in keys if k not in wanted]
+
     def get_id_col(self, table):
         """
         Returns the name of the ID column of the given table.
@@ -167,9 +420,9 @@ class AeroDB:
         res = self.execute_query(
             f"SELECT {namecol} FROM {table} WHERE {idcol} = :id",
             {"id": uid},
-            json=True
+            json_out=True
         )
-        return res[0]["NAME"]
+        return res[0][namecol]
 
     def list_table(self, table, cols="*", json_out=False):
         """
@@ -207,7 +460,8 @@ class AeroDB:
         params = (match,)
         if dry:
             return query, query[query.index("WHERE")+5:], params
-        result = self.execute_query(query, params=params, json_out=json_out)
+        result = self.execute_query(query, params=params, json_out=json_out,
+                                    shards=self.route(table, search, match))
         return result
 
     def where_table_in(self, table, search, match, cols="*", dry=False, json_out=False):
@@ -232,7 +486,8 @@ class AeroDB:
         params = match
         if dry:
             return query, query[query.index("WHERE")+6:], params
-        result = self.execute_query(query, params=params, json_out=json_out)
+        result = self.execute_query(query, params=params, json_out=json_out,
+                                    shards=self.route(table, search, match))
         return result
 
     def where_table_like(self, table, search, match, cols="*", dry=False, json_out=False):
@@ -362,11 +617,111 @@ class AeroDB:
                                         ids, json_out=True)
         return self.handle_output(table, json_out=json_out)
 
+    # SUMMARY helpers
+
+    def get_summary(self, level, ids=None, json_out=True):
+        """
+        Retrieves maintained rollups for clients, projects or stands. Raises
+        aggregates.SummariesMissing if rebuild_summaries hasn't been run.
+
+        Parameters:
+        level (str): "clients", "projects" or "stands".
+        ids (list, optional): The IDs to retrieve. If None, retrieves all.
+
+        Returns:
+        list of dict or pandas.DataFrame: One summary row per ID.
+        """
+        conn = self.con()
+        try:
+            if not aggregates.summaries_exist(conn):
+                raise aggregates.SummariesMissing(level)
+        finally:
+            conn.close()
+        table = aggregates.summary_table(level)
+        if ids is None:
+            rows = self.get_table(table, json_out=True)
+        else:
+            rows = self.where_table_in(
+                table, aggregates.LEVELS[level], ids, json_out=True)
+        rows = [aggregates.summary_record(r) for r in rows]
+        return self.handle_output(rows, json_out=json_out)
+
+    def rebuild_summaries(self):
+        """
+        Recomputes the summary tables from the current tables.
+        """
+        tables = ["flights", "flight_ai", "stands", "projects"]
+        rows = [self.get_table(t, json_out=True) for t in tables]
+        conn = self.con()
+        aggregates.rebuild_summaries(conn, *rows)
+        conn.close()
+
+    def summary_contributions(self, conn, table, row, schema="main"):
+        """
+        Returns what a row of the given table contributes to the summaries.
+        The related rows are read on the given connection, so edits made
+        earlier in its transaction are seen.
+
+        Parameters:
+        conn (sqlite3.Connection): A connection from write_con.
+        table (str): The name of the table.
+        row (dict): The row.
+        schema (str): The attached database holding the flight-side tables.
+
+        Returns:
+        list: (level, key, metrics) tuples, empty for tables that don't
+        feed the summaries.
+        """
+        def lookup(query, params):
+            return [dict(r) for r in conn.execute(query, params).fetchall()]
+
+        if table == "flights":
+            ai = lookup(f"SELECT * FROM {schema}.flight_ai WHERE FLIGHT_ID = ?",
+                        (row["FLIGHT_ID"],))
+            return aggregates.flight_contribution(row, ai[0] if ai else {})
+        if table == "flight_ai":
+            flight = lookup(f"SELECT * FROM {schema}.flights WHERE FLIGHT_ID = ?",
+                            (row["FLIGHT_ID"],))
+            if len(flight) == 0:
+                return []
+            return aggregates.flight_contribution(flight[0], row)
+        if table == "stands":
+            sid = row["STAND_PERSISTENT_ID"]
+            projects = lookup(
+                "SELECT * FROM main.projects WHERE STAND_PERSISTENT_IDS LIKE ?",
+                (f"%{sid}%",))
+            project_ids = [p["PROJECT_ID"] for p in projects
+                           if int(sid) in aggregates.project_stand_ids(p)]
+            return aggregates.stand_contribution(row, project_ids)
+        if table == "projects":
+            stand_ids = aggregates.project_stand_ids(row)
+            stands = []
+            if len(stand_ids) > 0:
+                plc = ", ".join(["?"] * len(stand_ids))
+                stands = lookup(
+                    f"SELECT * FROM main.stands WHERE STAND_PERSISTENT_ID IN ({plc})",
+                    stand_ids)
+            return aggregates.project_contribution(row, stands)
+        return []
+
     # CLIENT queries
 
     def clients(self, client_ids=None, json_out=True):
         return self.get_table_by_ids("clients", client_ids, json_out)
 
+    def client_summary(self, client_ids=None, json_out=True):
+        """
+        Retrieves flight counts, completion/QC/AI-ready counts, total acres
+        and mean AI TPA per client from the maintained summary table.
+
+        Parameters:
+        client_ids (list, optional): The IDs of the clients. If None, retrieves all clients.
+
+        Returns:
+        list of dict: One summary row per client.
+        """
+        return self.get_summary("clients", client_ids, json_out)
+
     def client_projects(self, client_ids=None, json_out=True):
         """
         Retrieves all projects for specified clients.
@@ -385,18 +740,19 @@ class AeroDB:
             client_projects = self.where_table_equal(
                 "projects", "CLIENT_ID", clients[i]["CLIENT_ID"]
             )
-            for cp in client_projects.to_dict("records"):
+            for cp in self.records(client_projects):
                 proj = {**clients[i], **cp}
                 projects.append(proj)
-        return self.data_view(projects, key="CLIENT_ID", json_out=json_out)
+        return self.group_records(projects, key="CLIENT_ID", json_out=json_out)
 
-    def client_stands_full_data(self, client_ids=None, json_out=True):
+    def client_stands_full_data(self, client_ids=None, cols=None, json_out=True):
         """
         Retrieves full stand data for the specified clients, including associated projects.
         If no clients are specified, retrieves data for all clients.
 
         Parameters:
         client_ids (list, optional): The IDs of the clients. If None, retrieves data for all clients.
+        cols (list, optional): The columns needed, see stand_full_data.
 
         Returns:
         dict: A dictionary mapping client IDs to a list of full stand data.
@@ -410,23 +766,36 @@ class AeroDB:
             if sid is None or sid == "":
                 continue
             stand_ids.extend(sid.split(","))
-        stand_data = self.stand_full_data(stand_ids, json_out=json_out)
-        return self.data_view(stand_data, "CLIENT_ID", json_out=json_out)
+        stand_data = self.stand_full_data(stand_ids, cols=cols, json_out=json_out)
+        return self.group_records(stand_data, "CLIENT_ID", json_out=json_out)
 
-    def client_flights_full_data(self, client_ids=None, json_out=True):
+    def client_flights_full_data(self, client_ids=None, cols=None, json_out=True):
         client_ids = self.get_ids("clients", client_ids)
         flight_ids = self.where_table_in(
             "flights", "CLIENT_ID", client_ids, "FLIGHT_ID"
         )
         flight_ids = flight_ids["FLIGHT_ID"].tolist()
-        flight_data = self.flight_full_data(flight_ids)
-        return self.data_view(flight_data, "CLIENT_ID", json_out=json_out)
+        flight_data = self.flight_full_data(flight_ids, cols=cols)
+        return self.group_records(flight_data, "CLIENT_ID", json_out=json_out)
 
     # PROJECT queries
 
     def projects(self, project_ids=None, json_out=True):
         return self.get_table_by_ids("projects", project_ids, json_out)
 
+    def project_summary(self, project_ids=None, json_out=True):
+        """
+        Retrieves flight counts, completion/QC/AI-ready counts, total acres
+        and mean AI TPA per project from the maintained summary table.
+
+        Parameters:
+        project_ids (list, optional): The IDs of the projects. If None, retrieves all projects.
+
+        Returns:
+        list of dict: One summary row per project.
+        """
+        return self.get_summary("projects", project_ids, json_out)
+
     def project_stands(self, project_ids=None, json_out=True):
         """
         Retrieves all stands for specified projects.
@@ -441,7 +810,7 @@ class AeroDB:
         projects = self.where_table_in(
             "projects", "PROJECT_ID", project_ids
         )
-        projects = projects.to_dict("records")
+        projects = self.records(projects)
         stands = []
         for i, project in enumerate(projects):
             project_stand_list = project["STAND_PERSISTENT_IDS"]
@@ -451,18 +820,19 @@ class AeroDB:
             project_stands = self.where_table_in(
                 "stands", "STAND_PERSISTENT_ID", project_stand_list
             )
-            for ps in project_stands.to_dict("records"):
+            for ps in self.records(project_stands):
                 ps = {**ps, **project}
                 stands.append(ps)
-        return self.data_view(stands, key="PROJECT_ID", json_out=json_out)
+        return self.group_records(stands, key="PROJECT_ID", json_out=json_out)
 
-    def project_stands_full_data(self, project_ids=None, json_out=True):
+    def project_stands_full_data(self, project_ids=None, cols=None, json_out=True):
         """
         Retrieves full stand data for the specified projects, including associated clients.
         If no projects are specified, retrieves data for all projects.
 
         Parameters:
         project_ids (list, optional): The IDs of the projects. If None, retrieves data for all projects.
+        cols (list, optional): The columns needed, see stand_full_data.
 
         Returns:
         dict: A dictionary mapping client IDs to a list of full stand data.
@@ -476,28 +846,46 @@ class AeroDB:
             if sid is None or sid == "":
                 continue
             stand_ids.extend(sid.split(","))
-        stand_data = self.stand_full_data(stand_ids)
-        return self.data_view(stand_data, key="PROJECT_ID", json_out=json_out)
+        # the stands are grouped by project, so their project is always needed
+        if cols is not None and len(cols) > 0:
+            cols = list(cols) + ["PROJECT_ID"]
+        stand_data = self.stand_full_data(stand_ids, cols=cols)
+        return self.group_records(stand_data, key="PROJECT_ID", json_out=json_out)
 
-    def project_flights_full_data(self, project_ids=None, json_out=True):
+    def project_flights_full_data(self, project_ids=None, cols=None, json_out=True):
         project_ids = self.get_ids("projects", project_ids)
         flight_ids = self.where_table_in(
             "flights", "PROJECT_ID", project_ids, "FLIGHT_ID",
         )
         flight_ids = flight_ids["FLIGHT_ID"].tolist()
-        flight_data = self.flight_full_data(flight_ids)
-        return self.data_view(flight_data, "PROJECT_ID", json_out=json_out)
+        flight_data = self.flight_full_data(flight_ids, cols=cols)
+        return self.group_records(flight_data, "PROJECT_ID", json_out=json_out)
 
     # STAND queries
 
     def stands(self, stand_ids=None, json_out=True):
         return self.get_table_by_ids("stands", stand_ids, json_out)
 
-    def stand_flights_full_data(self, stand_ids=None, json_out=True):
+    def stand_summary(self, stand_ids=None, json_out=True):
+        """
+        Retrieves flight counts, completion/QC/AI-ready counts, acres and
+        mean AI TPA per stand from the maintained summary table.
+
+        Parameters:
+        stand_ids (list, optional): The IDs of the stands. If None, retrieves all stands.
+
+        Returns:
+        list of dict: One summary row per stand.
+        """
+        return self.get_summary("stands", stand_ids, json_out)
+
+    def stand_flights_full_data(self, stand_ids=None, cols=None, json_out=True):
         stand_ids = self.get_ids("stands", stand_ids)
+        stand_keys = ["STAND_PERSISTENT_ID", "CLIENT_ID"]
         stands = self.where_table_in(
-            "stands", "STAND_PERSISTENT_ID", stand_ids)
-        stands = stands.to_dict("records")
+            "stands", "STAND_PERSISTENT_ID", stand_ids,
+            self.select_cols("stands", cols, stand_keys) or stand_keys)
+        stands = self.records(stands)
         stand_flights = []
         for i in range(len(stands)):
             query = {
@@ -518,38 +906,48 @@ class AeroDB:
             }
             flights = self.query_from_json(query, json_out=False)
             flight_ids = flights["FLIGHT_ID"].tolist()
-            for flight in self.flight_full_data(flight_ids=flight_ids, json_out=True):
+            for flight in self.flight_full_data(flight_ids=flight_ids, cols=cols, json_out=True):
                 stand_flight = {**stands[i], **flight}
                 stand_flights.append(stand_flight)
-        return self.data_view(stand_flights, key="STAND_PERSISTENT_ID", json_out=json_out)
+        return self.group_records(stand_flights, key="STAND_PERSISTENT_ID", json_out=json_out)
 
-    def stand_full_data(self, stand_ids=None, json_out=True):
+    def stand_full_data(self, stand_ids=None, cols=None, json_out=True):
         """
         Retrieves all data for specified stands, including associated clients and projects.
 
         Parameters:
         stand_ids (list, optional): The IDs of the stands. If None, retrieves data for all stands.
+        cols (list, optional): The columns needed. If given, only these columns and the
+            join keys are read from each table, and the project lookups are skipped when
+            no project columns are needed.
 
         Returns:
         list: A list of dictionaries containing stand data.
         """
         stand_ids = self.get_ids("stands", stand_ids)
+        stand_keys = ["STAND_PERSISTENT_ID", "CLIENT_ID"]
         stands = self.where_table_in(
-            "stands", "STAND_PERSISTENT_ID", stand_ids
+            "stands", "STAND_PERSISTENT_ID", stand_ids,
+            self.select_cols("stands", cols, stand_keys) or stand_keys
         )
+        client_cols = self.select_cols("clients", cols, ["CLIENT_ID"]) or ["CLIENT_ID"]
+        project_cols = self.select_cols("projects", cols, ["PROJECT_ID"])
         stand_client_ids = stands["CLIENT_ID"].unique().tolist()
-        clients = self.where_table_in("clients", "CLIENT_ID", stand_client_ids)
+        clients = self.where_table_in("clients", "CLIENT_ID", stand_client_ids, client_cols)
         stands = stands.merge(clients, on="CLIENT_ID", how="left")
-        stands = stands.to_dict("records")
+        stands = self.records(stands)
         for i in range(len(stands)):
+            if project_cols == []:
+                break
             project = self.where_table_like(
-                "projects", "STAND_PERSISTENT_IDS", stands[i]["STAND_PERSISTENT_ID"]
-            ).to_dict("records")
+                "projects", "STAND_PERSISTENT_IDS", stands[i]["STAND_PERSISTENT_ID"],
+                project_cols, json_out=True
+            )
             if len(project) == 0:
                 continue
             client = self.where_table_equal(
-                "clients", "CLIENT_ID", stands[i]["CLIENT_ID"]
-            ).to_dict("records")
+                "clients", "CLIENT_ID", stands[i]["CLIENT_ID"], client_cols, json_out=True
+            )
             stands[i] = {**stands[i], **project[0], **client[0]}
         return self.handle_output(stands, json_out=json_out)
 
@@ -558,32 +956,50 @@ class AeroDB:
     def flights(self, flight_ids=None, json_out=True):
         return self.get_table_by_ids("flights", flight_ids, json_out)
 
-    def flight_full_data(self, flight_ids=None, json_out=True):
+    def flight_full_data(self, flight_ids=None, cols=None, json_out=True):
+        """
+        Retrieves flights merged with their AI data, files, stand, client and project.
+
+        Parameters:
+        flight_ids (list, optional): The IDs of the flights. If None, retrieves all flights.
+        cols (list, optional): The columns needed. If given, only these columns and the
+            join keys are read from each table, and tables holding none of them aren't read.
+
+        Returns:
+        list: A list of dictionaries containing flight data.
+        """
         flight_ids = self.get_ids("flights", flight_ids)
-        flights = self.where_table_in("flights", "FLIGHT_ID", flight_ids)
-        flights = flights.to_dict("records")
+        flight_keys = ["FLIGHT_ID", "STAND_PERSISTENT_ID", "CLIENT_ID", "PROJECT_ID"]
+        flight_cols = self.select_cols("flights", cols, flight_keys) or flight_keys
+        flights = self.where_table_in(
+            "flights", "FLIGHT_ID", flight_ids, flight_cols, json_out=True
+        )
+        # merged in this order, later tables win on shared column names
+        lookups = [
+            ("flight_ai", "FLIGHT_ID"),
+            ("flight_files", "FLIGHT_ID"),
+            ("stands", "STAND_PERSISTENT_ID"),
+            ("clients", "CLIENT_ID"),
+            ("projects", "PROJECT_ID"),
+        ]
+        # the columns the flight row already holds aren't looked up again
+        if cols is not None and len(cols) > 0:
+            rest = [c for c in cols if c not in flight_cols]
+            lookup_cols = {t: self.select_cols(t, rest, [k]) if rest else []
+                           for t, k in lookups}
+        else:
+            lookup_cols = {t: "*" for t, _ in lookups}
         for i in range(len(flights)):
-            flight_ai = self.where_table_equal(
-                "flight_ai", "FLIGHT_ID", flights[i]["FLIGHT_ID"]
-            ).to_dict("records")[0]
-            flight_files = self.where_table_equal(
-                "flight_files", "FLIGHT_ID", flights[i]["FLIGHT_ID"]
-            ).to_dict("records")[0]
-            stand = self.where_table_equal(
-                "stands", "STAND_PERSISTENT_ID", flights[i]["STAND_PERSISTENT_ID"]
-            ).to_dict("records")[0]
-            client = self.where_table_equal(
-                "clients", "CLIENT_ID", flights[i]["CLIENT_ID"]
-            ).to_dict("records")[0]
-            project = {}
-            if flights[i]["PROJECT_ID"] != -1:
-                project = self.where_table_equal(
-                    "projects", "PROJECT_ID", flights[i]["PROJECT_ID"]
-                ).to_dict("records")[0]
-            flights[i] = {
-                **flights[i], **flight_ai, **flight_files,
-                **stand, **client, **project
-            }
+            flight = dict(flights[i])
+            for table, key in lookups:
+                if lookup_cols[table] == []:
+                    continue
+                if table == "projects" and flights[i]["PROJECT_ID"] == -1:
+                    continue
+                flight.update(self.where_table_equal(
+                    table, key, flights[i][key], lookup_cols[table], json_out=True
+                )[0])
+            flights[i] = flight
         return self.handle_output(flights, json_out=json_out)
 
     # data filtering/sorting/management
@@ -610,10 +1026,31 @@ class AeroDB:
         dict: A dictionary mapping keys to a list of stand data.
         """
         if data is None or len(data) == 0:
-            data = self.flight_full_data()
+            # only read the columns the view keeps, and the key it groups by
+            wanted = None
+            if cols is not None and isinstance(cols, list) and len(cols) > 0:
+                wanted = cols + [key] if key and key not in cols else cols
+            data = self.flight_full_data(cols=wanted)
         # return self.handle_output(data, json_out=json_out)
+        return self.group_records(data, key, cols, json_out)
+
+    def group_records(self, data, key=None, cols=None, json_out=True):
+        """
+        Groups records by a key. Unlike data_view, no records gives an
+        empty view rather than every flight.
+
+        Parameters:
+        data (list or pandas.DataFrame): The records.
+        key (str, optional): The column to group by. If None, returns the ungrouped data.
+        cols (list, optional): The columns to include in the view.
+
+        Returns:
+        dict: A dictionary mapping keys to a list of records.
+        """
         if key is None or len(key) == 0:
             return data
+        if len(data) == 0:
+            return self.handle_output({}, json_out=json_out)
         data = pd.DataFrame(data)
         if cols is not None and isinstance(cols, list) and len(cols) > 0:
             if key not in cols:
@@ -623,10 +1060,51 @@ class AeroDB:
         view = {}
         for val in uniq:
             sel = data[data[key] == val]
-            sel = sel.to_dict("records")
+            sel = self.records(sel)
             view[val] = sel
         return self.handle_output(view, json_out=json_out)
 
+    def data_aggregate(self, table="flight_full", group_by=[], metrics=[["count", "*"]],
+                       filters={}, json_out=True):
+        """
+        Runs an aggregate query over the Parquet snapshots with DuckDB, so
+        heavy group-bys never touch the SQLite database.
+
+        Parameters:
+        table (str): A snapshot table, or "flight_full" for flights joined
+            with their AI results, project and client.
+        group_by (list): Columns, or {"col": ..., "bucket": "quarter"} to
+            group a date column by year, quarter or month.
+        metrics (list): [func, col] pairs, func one of count, sum, avg, min, max.
+        filters (dict): Column -> value equality filters.
+
+        Returns:
+        list of dict or pandas.DataFrame: One row per group.
+        """
+        data = self.get_analytics().aggregate(table, group_by, metrics, filters)
+        if json_out:
+            # go through JSON so numpy and timestamp values serialize
+            return json.loads(data.to_json(orient="records", date_format="iso"))
+        return data
+
+    def get_analytics(self):
+        """
+        Returns the Analytics over the current snapshots, building it again
+        when they were exported since, e.g. by the nightly job in another
+        process.
+        """
+        with self._analytics_lock:
+            stamp = analytics.snapshot_stamp(self.snapshot_dir)
+            if self._analytics is None or self._analytics.stamp != stamp:
+                self._analytics = analytics.Analytics(self.snapshot_dir)
+            return self._analytics
+
+    def export_snapshots(self, tables=analytics.SNAPSHOT_TABLES):
+        """
+        Writes Parquet snapshots of the tables for data_aggregate.
+        """
+        return analytics.export_snapshots(self, self.snapshot_dir, tables)
+
     def data_filter(self, json_filter, data=None, json_out=True):
         if data is None or len(data) == 0:
             data = self.flight_full_data()
@@ -638,30 +1116,138 @@ class AeroDB:
 
     # UPDATE methods
 
-    def update(self, table=None, orig_data=None, data=None, json_out=True):
+    def add_row_versions(self):
+        """
+        Adds the row version column to the editable tables, including the
+        flights table in every shard.
+        """
+        dbs = ["aerodb"]
+        if self.shard_by is not None:
+            dbs.extend(list_shards(self.base))
+        for db in dbs:
+            conn = self.con(db)
+            add_row_versions(conn)
+            conn.close()
+
+    def prepare_update(self, table, orig_data, data):
+        """
+        Works out the write an edit needs: the columns that differ between
+        orig_data and data, the row version to check and, when sharded, the
+        shard holding the row and the shard it moves to if its client
+        changes.
+
+        Parameters:
+        table (str): The name of the table.
+        orig_data (dict): The row as the caller last saw it.
+        data (dict): The edited row.
+
+        Returns:
+        dict or None: The edit, for apply_update, or None if nothing
+        changed.
+        """
         id_col = self.get_id_col(table)
-        entry = self.where_table_equal(
-            table, id_col, orig_data[id_col], json_out=True)[0]
-        update_cols = []
-        update_vals = []
+        changes = {}
         for k in data.keys():
-            if str(entry[k]) == str(data[k]):
+            if k in (id_col, VERSION_COL):
                 continue
-            update_cols.append(k)
-            update_vals.append(data[k])
-        query = f"UPDATE {table} SET "
-        for i in range(len(update_cols)):
-            query += f"{update_cols[i]} = ?"
-            if i < len(update_cols) - 1:
-                query += ", "
-        query += f" WHERE {id_col} = ?"
-        update_values = tuple(update_vals + [entry[id_col]])
-        conn = self.con()
-        cursor = conn.cursor()
-        cursor.execute(query, update_values)
-        conn.commit()
-        cursor.close()
-        conn.close()
+            if str(orig_data.get(k)) == str(data[k]):
+                continue
+            changes[k] = data[k]
+        if len(changes) == 0:
+            return None
+        version = None
+        if table in VERSIONED_TABLES:
+            version = orig_data.get(VERSION_COL)
+        uid = orig_data[id_col]
+        edit = {
+            "table": table, "id_col": id_col, "uid": uid,
+            "orig_data": orig_data, "changes": changes, "version": version,
+            "schema": "main", "shards": [], "move_to": None, "missing": False,
+        }
+        if self.shard_by is None or table not in SHARD_TABLES:
+            return edit
+        shard = self.locate(table, id_col, uid)
+        if shard is None:
+            edit["missing"] = True
+            return edit
+        edit["schema"] = shard
+        edit["shards"] = [shard]
+        if table == "flights" and "CLIENT_ID" in changes:
+            target = shard_name(changes["CLIENT_ID"])
+            if target != shard:
+                edit["move_to"] = target
+                edit["shards"].append(target)
+        return edit
+
+    def apply_update(self, conn, edit):
+        """
+        Runs a prepared edit in the connection's open transaction: the row
+        update, a move to another shard if its client changed, and the
+        change to the summary tables. The caller commits.
+
+        Parameters:
+        conn (sqlite3.Connection): A connection from write_con with
+            edit["shards"] attached and a transaction open.
+        edit (dict): The edit, see prepare_update.
+
+        Returns:
+        dict: "status" is "updated" or "conflict"; "row" is the row as it
+        now is in the database.
+        """
+        table = edit["table"]
+        schema = edit["schema"]
+        if edit["missing"]:
+            return {"status": "conflict", "row": None}
+        before, row = conditional_update(
+            conn, table, edit["id_col"], edit["uid"], edit["changes"],
+            edit["version"], commit=False, schema=schema)
+        if row is None:
+            return {"status": "conflict", "row": before}
+        summaries = aggregates.summaries_exist(conn)
+        if summaries:
+            removed = self.summary_contributions(conn, table, before, schema)
+        if edit["move_to"] is not None:
+            move_flight(conn, edit["uid"], row["CLIENT_ID"], schema, edit["move_to"])
+            schema = edit["move_to"]
+        if summaries:
+            aggregates.apply_contributions(conn, removed, sign=-1)
+            aggregates.apply_contributions(
+                conn, self.summary_contributions(conn, table, row, schema))
+        return {"status": "updated", "row": row}
+
+    def update(self, table=None, orig_data=None, data=None, json_out=True):
+        """
+        Updates the columns of a row that differ between orig_data and data,
+        and the summary tables with it, in one transaction.
+
+        On versioned tables every update bumps the row version, and when
+        orig_data carries the row version the update only applies if the row
+        is still at that version, so an edit made against a stale row is
+        reported instead of overwriting newer values.
+
+        Parameters:
+        table (str): The name of the table.
+        orig_data (dict): The row as the caller last saw it.
+        data (dict): The edited row.
+
+        Returns:
+        dict: "status" is "updated", "unchanged" or "conflict"; "row" is the
+        row as it now is in the database.
+        """
+        edit = self.prepare_update(table, orig_data, data)
+        if edit is None:
+            return {"status": "unchanged", "row": None}
+        conn = self.write_con(edit["shards"])
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            result = self.apply_update(conn, edit)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return result
 
 
 def list_aerodb_fns():
@@ -0,0 +1,198 @@
+import math
+
+# rollups kept per client, project and stand. Each summary table is keyed
+# by the level's ID column and holds additive counters, so an edit can be
+# applied as a delta instead of rescanning flights
+LEVELS = {
+    "clients": "CLIENT_ID",
+    "projects": "PROJECT_ID",
+    "stands": "STAND_PERSISTENT_ID",
+}
+METRICS = [
+    "FLIGHTS", "FLIGHTS_COMPLETE", "QC_APPROVED", "AI_READY",
+    "AI_TPA_SUM", "AI_TPA_COUNT", "ACRES",
+]
+METRIC_TYPES = {"AI_TPA_SUM": "REAL", "ACRES": "REAL"}
+TRUE_VALUES = [1, True, "1", "true", "True", "TRUE"]
+
+
+def summary_table(level):
+    return f"summary_{level}"
+
+
+class SummariesMissing(Exception):
+    # the summary tables are built by rebuild_summaries, e.g. after ingestion
+
+    def __init__(self, level):
+        self.level = level
+        super().__init__(
+            f"The {summary_table(level)} table doesn't exist; "
+            f"run rebuild_summaries (python aggregates.py) to build them")
+
+
+def summaries_exist(conn, schema="main"):
+    """
+    Returns True if the summary tables have been built.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection to the main database.
+    schema (str): The schema holding the summary tables.
+    """
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?",
+        (summary_table("clients"),)).fetchone()
+    return row is not None
+
+
+def flag(value):
+    return 1 if value in TRUE_VALUES else 0
+
+
+def number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value):
+        return None
+    return value
+
+
+def flight_contribution(flight, ai):
+    """
+    Returns what a single flight adds to the summaries.
+
+    Parameters:
+    flight (dict): The flight's row in the flights table.
+    ai (dict): The flight's row in the flight_ai table, or {}.
+
+    Returns:
+    list: (level, key, metrics) tuples.
+    """
+    tpa = number(ai.get("AI_TPA"))
+    metrics = {
+        "FLIGHTS": 1,
+        "FLIGHTS_COMPLETE": flag(flight.get("FLIGHT_COMPLETE")),
+        "QC_APPROVED": flag(ai.get("QC_APPROVED")),
+        "AI_READY": flag(ai.get("AI_READY")),
+        "AI_TPA_SUM": tpa or 0.0,
+        "AI_TPA_COUNT": 0 if tpa is None else 1,
+    }
+    return [(level, flight.get(col), metrics) for level, col in LEVELS.items()]
+
+
+def stand_contribution(stand, project_ids=[]):
+    """
+    Returns what a stand's acreage adds to the summaries.
+
+    Parameters:
+    stand (dict): The stand's row in the stands table.
+    project_ids (list): The projects listing the stand, if their acreage
+        should be included.
+
+    Returns:
+    list: (level, key, metrics) tuples.
+    """
+    metrics = {"ACRES": number(stand.get("ACRES")) or 0.0}
+    contrib = [
+        ("stands", stand.get("STAND_PERSISTENT_ID"), metrics),
+        ("clients", stand.get("CLIENT_ID"), metrics),
+    ]
+    for pid in project_ids:
+        contrib.append(("projects", pid, metrics))
+    return contrib
+
+
+def project_stand_ids(project):
+    ids = project.get("STAND_PERSISTENT_IDS")
+    if ids is None or ids == "":
+        return []
+    return [int(x) for x in str(ids).split(",") if x.strip() != ""]
+
+
+def project_contribution(project, stands):
+    """
+    Returns what the acreage of a project's stands adds to its summary.
+
+    Parameters:
+    project (dict): The project's row in the projects table.
+    stands (list): The rows of the stands listed by the project.
+
+    Returns:
+    list: (level, key, metrics) tuples.
+    """
+    acres = sum(number(s.get("ACRES")) or 0.0 for s in stands)
+    return [("projects", project.get("PROJECT_ID"), {"ACRES": acres})]
+
+
+def create_summary_tables(conn):
+    for level, col in LEVELS.items():
+        cols = ", ".join(f"{m} {METRIC_TYPES.get(m, 'INTEGER')} NOT NULL DEFAULT 0"
+                         for m in METRICS)
+        conn.execute(f"DROP TABLE IF EXISTS {summary_table(level)}")
+        conn.execute(
+            f"CREATE TABLE {summary_table(level)} ({col} BIGINT PRIMARY KEY, {cols})")
+
+
+def apply_contributions(conn, contributions, sign=1):
+    """
+    Adds (or with sign=-1 removes) contributions to the summary tables.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection to the main database.
+    contributions (list): (level, key, metrics) tuples.
+    sign (int): 1 to add, -1 to subtract.
+    """
+    for level, key, metrics in contributions:
+        if key is None:
+            continue
+        col = LEVELS[level]
+        names = list(metrics.keys())
+        updates = ", ".join(f"{m} = {m} + excluded.{m}" for m in names)
+        conn.execute(
+            f"INSERT INTO {summary_table(level)} ({col}, {', '.join(names)}) "
+            f"VALUES ({', '.join(['?'] * (len(names) + 1))}) "
+            f"ON CONFLICT({col}) DO UPDATE SET {updates}",
+            [key] + [sign * metrics[m] for m in names])
+
+
+def rebuild_summaries(conn, flights, flight_ai, stands, projects):
+    """
+    Recomputes every summary table from scratch, e.g. after ingestion.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection to the main database.
+    flights, flight_ai, stands, projects (list of dict): The table rows.
+    """
+    ai_by_flight = {a["FLIGHT_ID"]: a for a in flight_ai}
+    stands_by_id = {s["STAND_PERSISTENT_ID"]: s for s in stands}
+    create_summary_tables(conn)
+    contributions = []
+    for flight in flights:
+        ai = ai_by_flight.get(flight["FLIGHT_ID"], {})
+        contributions.extend(flight_contribution(flight, ai))
+    for stand in stands:
+        contributions.extend(stand_contribution(stand))
+    for project in projects:
+        listed = [stands_by_id[sid] for sid in project_stand_ids(project)
+                  if sid in stands_by_id]
+        contributions.extend(project_contribution(project, listed))
+    apply_contributions(conn, contributions)
+    conn.commit()
+
+
+def summary_record(row):
+    # add the derived columns to a stored summary row
+    row = dict(row)
+    row["FLIGHTS_PENDING"] = row["FLIGHTS"] - row["FLIGHTS_COMPLETE"]
+    row["AI_TPA_MEAN"] = None
+    if row["AI_TPA_COUNT"] > 0:
+        row["AI_TPA_MEAN"] = row["AI_TPA_SUM"] / row["AI_TPA_COUNT"]
+    return row
+
+
+if __name__ == "__main__":
+    # build or rebuild the summary tables from the current tables:
+    #   AERODB_DIR=/path/to/dbs python aggregates.py
+    from aerodb import AeroDB
+    AeroDB(dev=False).rebuild_summaries()
@@ -0,0 +1,219 @@
+import os
+import shutil
+from pathlib import Path
+from guards import interrupt_at_deadline, count_rows
+
+SNAPSHOT_TABLES = [
+    "clients", "projects", "stands", "flights", "flight_ai", "flight_files",
+]
+AGG_FUNCS = ["count", "sum", "avg", "min", "max"]
+BUCKETS = ["year", "quarter", "month"]
+
+# the flight_full view joins a flight with its AI results, project and
+# client, taking each column from the first table that has it
+FLIGHT_FULL = [
+    ("flights", None),
+    ("flight_ai", "FLIGHT_ID"),
+    ("projects", "PROJECT_ID"),
+    ("clients", "CLIENT_ID"),
+]
+
+
+def export_snapshots(db, out_dir, tables=SNAPSHOT_TABLES):
+    """
+    Exports AeroDB tables to Parquet, partitioned by client where the table
+    has (or, for the flight-side tables, can be joined to) a CLIENT_ID.
+
+    Each table is written next to the live snapshot and swapped in when
+    complete, so queries never read a partial export.
+
+    Parameters:
+    db (AeroDB): The database object to export from.
+    out_dir (str): The snapshot directory.
+    tables (list): The tables to export.
+
+    Returns:
+    list: The exported table directories.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    flight_clients = db.get_table("flights", json_out=False)[["FLIGHT_ID", "CLIENT_ID"]]
+    written = []
+    for table in tables:
+        df = db.get_table(table, json_out=False)
+        if "CLIENT_ID" not in df.columns and "FLIGHT_ID" in df.columns:
+            df = df.merge(flight_clients, on="FLIGHT_ID", how="left")
+        tmp = out_dir / (table + ".tmp")
+        final = out_dir / table
+        shutil.rmtree(tmp, ignore_errors=True)
+        # an empty table has no partitions, so pyarrow writes no directory
+        if "CLIENT_ID" in df.columns and len(df) > 0:
+            df.to_parquet(tmp, partition_cols=["CLIENT_ID"], index=False)
+        else:
+            tmp.mkdir()
+            df.to_parquet(tmp / "data.parquet", index=False)
+        old = out_dir / (table + ".old")
+        shutil.rmtree(old, ignore_errors=True)
+        if final.exists():
+            os.rename(final, old)
+        os.rename(tmp, final)
+        shutil.rmtree(old, ignore_errors=True)
+        written.append(final.as_posix())
+    return written
+
+
+def snapshot_stamp(snapshot_dir):
+    """
+    Identifies the current snapshots. export_snapshots swaps in a new
+    directory for each table, so the stamp changes with every export.
+
+    Returns:
+    tuple: (table, inode, mtime) for each table that has a snapshot.
+    """
+    stamp = []
+    for table in SNAPSHOT_TABLES:
+        try:
+            st = os.stat(Path(snapshot_dir) / table)
+        except FileNotFoundError:
+            continue
+        stamp.append((table, st.st_ino, st.st_mtime_ns))
+    return tuple(stamp)
+
+
+class Analytics:
+    """
+    Runs aggregate queries with DuckDB over Parquet snapshots, keeping heavy
+    group-bys off the SQLite file the API and dashboard use. Queries run on
+    their own cursor, so one instance can be shared between threads.
+
+    Parameters:
+    snapshot_dir (str): The directory written by export_snapshots.
+    """
+
+    def __init__(self, snapshot_dir):
+        # duckdb is optional and slow to import, so it is loaded here
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("analytics requires the duckdb package")
+        self.snapshot_dir = Path(snapshot_dir)
+        self.stamp = snapshot_stamp(snapshot_dir)
+        self.con = duckdb.connect()
+        self.columns = {}
+        for table in SNAPSHOT_TABLES:
+            path = self.snapshot_dir / table
+            if not path.exists():
+                continue
+            glob = (path / "**" / "*.parquet").as_posix()
+            self.con.execute(
+                f"CREATE VIEW {table} AS SELECT * FROM "
+                f"read_parquet('{glob}', hive_partitioning=true)")
+            self.columns[table] = self._describe(table)
+        self._create_flight_full()
+
+    def _describe(self, view):
+        return [r[0] for r in self.con.execute(f"DESCRIBE {view}").fetchall()]
+
+    def _create_flight_full(self):
+        if any(t not in self.columns for t, _ in FLIGHT_FULL):
+            return
+        seen = set()
+        select = []
+        joins = []
+        for table, key in FLIGHT_FULL:
+            for col in self.columns[table]:
+                if col in seen:
+                    continue
+                seen.add(col)
+                select.append(f'{table}."{col}"')
+            if key is not None:
+                joins.append(
+                    f'LEFT JOIN {table} ON {table}."{key}" = flights."{key}"')
+        self.con.execute(
+            f"CREATE VIEW flight_full AS SELECT {', '.join(select)} "
+            f"FROM flights {' '.join(joins)}")
+        self.columns["flight_full"] = self._describe("flight_full")
+
+    def query(self, sql, params=None):
+        """
+        Runs a raw SQL query against the snapshot views.
+
+        Returns:
+        pandas.DataFrame: The result.
+        """
+        # a duckdb connection isn't safe to share between threads, its
+        # cursors are
+        cur = self.con.cursor()
+        # duckdb has no progress handler, so the query is interrupted when
+        # the current budget runs out
+        timer = interrupt_at_deadline(cur.interrupt)
+        try:
+            data = cur.execute(sql, params or []).df()
+            count_rows(len(data))
+            return data
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cur.close()
+
+    def _column(self, table, col):
+        if col not in self.columns[table]:
+            raise ValueError(f"No column {col} in {table}")
+        return f'"{col}"'
+
+    def aggregate(self, table, group_by=[], metrics=[], filters={}):
+        """
+        Groups a snapshot table and computes aggregates.
+
+        Parameters:
+        table (str): A snapshot table, or "flight_full".
+        group_by (list): Column names, or {"col": ..., "bucket": "year" |
+            "quarter" | "month"} to group a date column by period.
+        metrics (list): [func, col] pairs, func one of count, sum, avg, min,
+            max; col may be "*" for count.
+        filters (dict): Column -> value equality filters.
+
+        Returns:
+        pandas.DataFrame: One row per group.
+        """
+        if table not in self.columns:
+            raise ValueError(f"No snapshot table: {table}")
+        groups = []
+        for g in group_by:
+            if isinstance(g, dict):
+                if g["bucket"] not in BUCKETS:
+                    raise ValueError(f"Unsupported bucket: {g['bucket']}")
+                col = self._column(table, g["col"])
+                groups.append(
+                    f"date_trunc('{g['bucket']}', CAST({col} AS DATE)) "
+                    f"AS \"{g['col']}_{g['bucket'].upper()}\"")
+            else:
+                groups.append(self._column(table, g))
+        aggs = []
+        for func, col in metrics:
+            if func.lower() not in AGG_FUNCS:
+                raise ValueError(f"Unsupported aggregate: {func}")
+            expr = "*" if col == "*" else self._column(table, col)
+            name = f"{func.upper()}_{'ROWS' if col == '*' else col}"
+            aggs.append(f"{func.upper()}({expr}) AS \"{name}\"")
+        where = []
+        params = []
+        for col, val in filters.items():
+            where.append(f"{self._column(table, col)} = ?")
+            params.append(val)
+        sql = f"SELECT {', '.join(groups + aggs)} FROM {table}"
+        if len(where) > 0:
+            sql += " WHERE " + " AND ".join(where)
+        if len(groups) > 0:
+            keys = ", ".join(str(i + 1) for i in range(len(groups)))
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self.query(sql, params)
+
+
+if __name__ == "__main__":
+    # refresh the snapshots, e.g. nightly after ingestion:
+    #   AERODB_DIR=/path/to/dbs python analytics.py
+    from aerodb import AeroDB
+    db = AeroDB(dev=False)
+    for path in db.export_snapshots():
+        print(path)
@@ -0,0 +1,68 @@
+import os
+import time
+import sqlite3
+import tempfile
+import pandas as pd
+from aerodb import AeroDB
+
+# compares point and small IN lookups through pd.read_sql against the
+# cursor-level fetch_records path, on a synthetic flights table
+
+
+def build_db(base, n_rows=100000):
+    conn = sqlite3.connect(os.path.join(base, "aerodb.db"))
+    conn.execute(
+        "CREATE TABLE flights (FLIGHT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT, "
+        "PROJECT_ID BIGINT, STAND_PERSISTENT_ID BIGINT, FLIGHT_COMPLETE BOOLEAN)"
+    )
+    rows = [(10000000 + i, i % 50, i % 400, 1000000 + i % 5000, i % 2)
+            for i in range(n_rows)]
+    conn.executemany("INSERT INTO flights VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def timeit(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main(n=2000):
+    with tempfile.TemporaryDirectory() as base:
+        build_db(base)
+        os.environ["AERODB_DIR"] = base
+        db = AeroDB(dev=False)
+        point = "SELECT * FROM flights WHERE FLIGHT_ID = ?"
+        many = "SELECT * FROM flights WHERE FLIGHT_ID in (?, ?, ?, ?, ?, ?, ?, ?)"
+
+        def pandas_point(i):
+            conn = db.con()
+            pd.read_sql(point, conn, params=(10000000 + i,)).to_dict("records")[0]
+            conn.close()
+
+        def fetch_point(i):
+            db.fetch_records(point, (10000000 + i,))[0]
+
+        def pandas_in(i):
+            conn = db.con()
+            pd.read_sql(many, conn, params=[10000000 + i + k for k in range(8)]).to_dict("records")
+            conn.close()
+
+        def fetch_in(i):
+            db.fetch_records(many, [10000000 + i + k for k in range(8)])
+
+        # both paths must return the same records for the timings to compare
+        ids = [10000000 + k for k in range(8)]
+        conn = db.con()
+        assert pd.read_sql(many, conn, params=ids).to_dict("records") == db.fetch_records(many, ids)
+        conn.close()
+
+        for name, fn in [("pandas point", pandas_point), ("fetch point", fetch_point),
+                         ("pandas IN(8)", pandas_in), ("fetch IN(8)", fetch_in)]:
+            print(f"{name:14s} {timeit(fn, n):8.1f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+
+# zstd and brotli are optional, gzip is always available through zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# responses smaller than this are sent as-is, compressing them costs more
+# than it saves
+MIN_SIZE = 1024
+
+# order of preference when the client weighs several encodings equally
+PREFERENCE = ["zstd", "br", "gzip"]
+
+
+def available_encodings():
+    """
+    Returns the content encodings that can be produced in this environment.
+
+    Returns:
+    list: Encoding names in order of preference.
+    """
+    encodings = []
+    for enc in PREFERENCE:
+        if enc == "zstd" and zstandard is None:
+            continue
+        if enc == "br" and brotli is None:
+            continue
+        encodings.append(enc)
+    return encodings
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks the best encoding for an Accept-Encoding request header.
+
+    Parameters:
+    accept_encoding (str): The raw Accept-Encoding header value.
+
+    Returns:
+    str or None: The chosen encoding, or None to send the body uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        part = part.strip()
+        if len(part) == 0:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for enc in available_encodings():
+        q = weights.get(enc, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def compressor(encoding, level=None):
+    """
+    Creates an incremental compressor for the given encoding.
+
+    Parameters:
+    encoding (str): One of "gzip", "zstd" or "br".
+    level (int, optional): The compression level, or None for the default.
+
+    Returns:
+    object: An object with compress(bytes) and flush() methods.
+    """
+    if encoding == "gzip":
+        level = 6 if level is None else level
+        # wbits=31 writes a gzip header and trailer
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if encoding == "zstd":
+        level = 3 if level is None else level
+        return _ZstdStream(zstandard.ZstdCompressor(level=level).compressobj())
+    if encoding == "br":
+        level = 5 if level is None else level
+        return _BrotliStream(brotli.Compressor(quality=level))
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+class _ZstdStream:
+
+    def __init__(self, cobj):
+        self.cobj = cobj
+
+    def compress(self, data):
+        out = self.cobj.compress(data)
+        # emit a frame block per chunk so chunked output is not held back
+        return out + self.cobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self):
+        return self.cobj.flush()
+
+
+class _BrotliStream:
+
+    def __init__(self, cobj):
+        self.cobj = cobj
+
+    def compress(self, data):
+        return self.cobj.process(data) + self.cobj.flush()
+
+    def flush(self):
+        return self.cobj.finish()
+
+
+def compress(data, encoding, level=None):
+    """
+    Compresses a complete payload.
+
+    Parameters:
+    data (bytes): The payload to compress.
+    encoding (str): One of "gzip", "zstd" or "br".
+    level (int, optional): The compression level, or None for the default.
+
+    Returns:
+    bytes: The compressed payload.
+    """
+    c = compressor(encoding, level)
+    return c.compress(data) + c.flush()
+
+
+def compress_stream(chunks, encoding, level=None):
+    """
+    Compresses an iterable of chunks lazily, yielding compressed chunks as
+    they become available so chunked transfer keeps working.
+
+    Parameters:
+    chunks (iterable): The bytes or str chunks of the response body.
+    encoding (str): One of "gzip", "zstd" or "br".
+    level (int, optional): The compression level, or None for the default.
+
+    Returns:
+    generator: The compressed chunks.
+    """
+    c = compressor(encoding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        if len(chunk) == 0:
+            continue
+        out = c.compress(chunk)
+        if encoding == "gzip":
+            out += c.flush(zlib.Z_SYNC_FLUSH)
+        if len(out) > 0:
+            yield out
+    yield c.flush()
+
+
+class CompressedCache:
+    """
+    A small LRU cache of compressed payloads keyed by the digest of the
+    uncompressed body and the encoding, so the same response served
+    repeatedly is only compressed once.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, data, encoding, level=None):
+        """
+        Returns the compressed form of data, compressing it only on a miss.
+
+        Parameters:
+        data (bytes): The uncompressed payload.
+        encoding (str): The content encoding to produce.
+        level (int, optional): The compression level.
+
+        Returns:
+        bytes: The compressed payload.
+        """
+        key = (hashlib.sha1(data).digest(), encoding, level)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+        body = compress(data, encoding, level)
+        if len(body) > self.max_bytes:
+            return body
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = body
+                self.size += len(body)
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+        return body
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def install_compression(app, min_size=None, level=None, cache=None):
+    """
+    Registers an after_request hook on a Flask app that compresses response
+    bodies according to the client's Accept-Encoding header.
+
+    Buffered responses below min_size are left alone, larger ones are
+    compressed through the shared CompressedCache. Streamed responses are
+    compressed chunk by chunk regardless of size.
+
+    Parameters:
+    app (flask.Flask): The app to install the hook on.
+    min_size (int, optional): Smallest body size worth compressing. Defaults
+        to app.config["COMPRESS_MIN_SIZE"] or MIN_SIZE.
+    level (int, optional): The compression level, or None for the default.
+    cache (CompressedCache, optional): Cache of compressed payloads.
+
+    Returns:
+    CompressedCache: The cache used by the hook.
+    """
+    from flask import request
+
+    if min_size is None:
+        min_size = app.config.get("COMPRESS_MIN_SIZE", MIN_SIZE)
+    if cache is None:
+        cache = CompressedCache()
+
+    @app.after_request
+    def compress_response(response):
+        if response.direct_passthrough or "Content-Encoding" in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(
+                response.response, encoding, level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(cache.get(data, encoding, level))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    return cache
@@ -0,0 +1,207 @@
+from lazy import lazy_import
+
+pd = lazy_import("pandas")
+
+# SQLite keeps the type names that SQLAlchemy declared when the tables were
+# written by processing/create_tables.py (BIGINT, BOOLEAN, FLOAT,
+# VARCHAR(50), DATE, ...), so we map those declared names to type families
+FAMILIES = [
+    ("bool", ("BOOL",)),
+    ("int", ("INT",)),
+    ("float", ("FLOAT", "REAL", "DOUBLE", "NUMERIC")),
+    ("str", ("CHAR", "TEXT", "CLOB")),
+    ("date", ("DATE", "TIME")),
+]
+
+INT_DTYPES = [
+    ("Int8", -2**7, 2**7 - 1),
+    ("Int16", -2**15, 2**15 - 1),
+    ("Int32", -2**31, 2**31 - 1),
+    ("Int64", -2**63, 2**63 - 1),
+]
+
+
+def type_family(decltype):
+    """
+    Maps a declared SQLite column type to a type family.
+
+    Parameters:
+    decltype (str): The declared type, e.g. "BIGINT" or "VARCHAR(50)".
+
+    Returns:
+    str or None: One of "bool", "int", "float", "str", "date", or None.
+    """
+    decltype = (decltype or "").upper()
+    for family, names in FAMILIES:
+        for name in names:
+            if name in decltype:
+                return family
+    return None
+
+
+def declared_types(con):
+    """
+    Reads the declared column types of every table in a database.
+
+    Columns shared between tables (CLIENT_ID, FLIGHT_ID, ...) are declared
+    with the same type everywhere, so a single column -> family map is enough.
+
+    Parameters:
+    con (sqlite3.Connection): An open connection to the database.
+
+    Returns:
+    dict: A dictionary mapping column names to type families.
+    """
+    cursor = con.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    tables = [t[0] for t in cursor.fetchall()]
+    types = {}
+    for table in tables:
+        cursor.execute(f"PRAGMA table_info({table})")
+        for column in cursor.fetchall():
+            family = type_family(column[2])
+            if family is not None:
+                types.setdefault(column[1], family)
+    cursor.close()
+    return types
+
+
+def _int_dtype(col):
+    vals = col.dropna()
+    if len(vals) == 0:
+        return "Int8"
+    lo, hi = vals.min(), vals.max()
+    for dtype, dmin, dmax in INT_DTYPES:
+        if lo >= dmin and hi <= dmax:
+            return dtype
+    return None
+
+
+def compact_column(col, family, category_ratio=0.5, arrow_strings=False):
+    """
+    Converts a column to the most compact dtype its type family allows.
+
+    Parameters:
+    col (pandas.Series): The column as produced by pd.read_sql.
+    family (str): The column's type family.
+    category_ratio (float): Strings become categoricals when the ratio of
+        unique values to rows is below this.
+    arrow_strings (bool): If True, remaining string columns use Arrow-backed
+        storage when pyarrow is installed.
+
+    Returns:
+    pandas.Series: The converted column, or the original if it doesn't fit.
+    """
+    try:
+        if family == "bool":
+            vals = col.dropna()
+            if vals.isin([0, 1, True, False]).all():
+                return col.astype("boolean")
+        elif family == "int":
+            vals = col.dropna()
+            if (vals == vals.round()).all():
+                dtype = _int_dtype(col)
+                if dtype is not None:
+                    return col.astype(dtype)
+        elif family == "str":
+            n = len(col)
+            if n > 0 and col.nunique(dropna=True) / n < category_ratio:
+                return col.astype("category")
+            if arrow_strings:
+                return col.astype("string[pyarrow]")
+    except (TypeError, ValueError, ImportError):
+        pass
+    return col
+
+
+def compact_frame(df, types, category_ratio=0.5, arrow_strings=False):
+    """
+    Converts every column of a DataFrame with a known type to a compact dtype.
+
+    Parameters:
+    df (pandas.DataFrame): The DataFrame to convert.
+    types (dict): A column -> type family map, see declared_types.
+    category_ratio (float): See compact_column.
+    arrow_strings (bool): See compact_column.
+
+    Returns:
+    pandas.DataFrame: The converted DataFrame.
+    """
+    for c in df.columns:
+        family = types.get(c)
+        if family is None:
+            continue
+        df[c] = compact_column(df[c], family, category_ratio, arrow_strings)
+    return df
+
+
+def plain_records(df):
+    """
+    Converts a DataFrame to records of plain Python values. Compact dtypes
+    hold missing values as pd.NA, which JSON can't encode, so every column
+    is cast to object and missing values become None.
+
+    Parameters:
+    df (pandas.DataFrame): The DataFrame to convert.
+
+    Returns:
+    list: One dict per row.
+    """
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+
+def frame_bytes(data):
+    """
+    Returns the deep memory usage of a query result in bytes.
+
+    Parameters:
+    data (pandas.DataFrame or dict): A DataFrame, or a dict of DataFrames.
+
+    Returns:
+    int: The total memory usage.
+    """
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(deep=True).sum())
+    if isinstance(data, dict):
+        return sum(frame_bytes(v) for v in data.values())
+    return 0
+
+
+def footprint_report(db, methods=None, **kwargs):
+    """
+    Runs AeroDB methods with and without compact dtypes and reports the
+    memory footprint of each result.
+
+    Parameters:
+    db (AeroDB): The database object to run the methods on.
+    methods (list, optional): Method names to report on. If None, reports
+        on every table plus the full-data methods.
+    kwargs: Extra arguments passed to every method.
+
+    Returns:
+    pandas.DataFrame: One row per method with default and compact sizes.
+    """
+    if methods is None:
+        methods = [
+            "clients", "projects", "stands", "flights",
+            "flight_full_data", "stand_full_data",
+        ]
+    compact = db.compact_dtypes
+    rows = []
+    try:
+        for method in methods:
+            sizes = {}
+            for mode in [False, True]:
+                db.compact_dtypes = mode
+                data = getattr(db, method)(json_out=False, **kwargs)
+                sizes[mode] = frame_bytes(data)
+            rows.append({
+                "method": method,
+                "default_bytes": sizes[False],
+                "compact_bytes": sizes[True],
+                "ratio": sizes[True] / sizes[False] if sizes[False] else 1.0,
+            })
+    finally:
+        db.compact_dtypes = compact
+    return pd.DataFrame(rows)
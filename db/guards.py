@@ -0,0 +1,224 @@
+import time
+import threading
+
+# execution budgets for API calls. A budget is entered around an AeroDB call
+# and applies to every connection the call opens on that thread
+DEFAULT_LIMITS = {
+    "seconds": 30,
+    "max_rows": 1000000,
+    "max_bytes": 256 * 1024 * 1024,
+}
+# the calls that scan everything when given no arguments get more time,
+# edits get less
+METHOD_LIMITS = {
+    "data_filter": {"seconds": 60},
+    "data_view": {"seconds": 60},
+    "flight_full_data": {"seconds": 60},
+    "stand_flights_full_data": {"seconds": 60},
+    "client_flights_full_data": {"seconds": 60},
+    "project_flights_full_data": {"seconds": 60},
+    "update": {"seconds": 10, "max_rows": 1000},
+}
+# background jobs (?async=1) don't hold a request open, so they get a larger
+# budget of their own instead of the per-method limits
+JOB_LIMITS = {
+    "seconds": 30 * 60,
+    "max_rows": 20000000,
+    "max_bytes": 4 * 1024 * 1024 * 1024,
+}
+# sqlite VM instructions between deadline checks
+PROGRESS_STEPS = 1000
+# rows fetched at a time, so the row limit is hit before a large result is
+# fully loaded
+FETCH_ROWS = 10000
+
+_local = threading.local()
+
+
+class BudgetExceeded(Exception):
+
+    def __init__(self, fn, kind, limit):
+        self.fn = fn
+        self.kind = kind
+        self.limit = limit
+        super().__init__(f"{fn} exceeded its {kind} limit of {limit}")
+
+
+def limits_for(fn_name, overrides=None):
+    """
+    Returns the limits for an AeroDB method.
+
+    Parameters:
+    fn_name (str): The name of the method.
+    overrides (dict, optional): fn_name -> limits, e.g. from app config;
+        the "default" key overrides DEFAULT_LIMITS.
+
+    Returns:
+    dict: "seconds", "max_rows" and "max_bytes", any of which may be None.
+    """
+    overrides = overrides or {}
+    limits = dict(DEFAULT_LIMITS)
+    limits.update(overrides.get("default", {}))
+    limits.update(METHOD_LIMITS.get(fn_name, {}))
+    limits.update(overrides.get(fn_name, {}))
+    return limits
+
+
+def job_limits_for(fn_name, overrides=None):
+    """
+    Returns the limits for an AeroDB method run as a background job.
+
+    Parameters:
+    fn_name (str): The name of the method.
+    overrides (dict, optional): fn_name -> limits, e.g. from app config;
+        the "default" key overrides JOB_LIMITS.
+
+    Returns:
+    dict: "seconds", "max_rows" and "max_bytes", any of which may be None.
+    """
+    overrides = overrides or {}
+    limits = dict(JOB_LIMITS)
+    limits.update(overrides.get("default", {}))
+    limits.update(overrides.get(fn_name, {}))
+    return limits
+
+
+class Budget:
+    """
+    A time and row budget for one call on the current thread.
+
+    Parameters:
+    fn (str): The name of the call, for error messages.
+    seconds (float, optional): Wall-clock limit.
+    max_rows (int, optional): Limit on rows fetched from SQLite in total.
+    max_bytes (int, optional): Limit on the serialized result, checked by
+        the caller with check_bytes.
+    """
+
+    def __init__(self, fn, seconds=None, max_rows=None, max_bytes=None):
+        self.fn = fn
+        self.seconds = seconds
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.deadline = None
+        self.rows = 0
+
+    def __enter__(self):
+        if self.seconds is not None:
+            self.deadline = time.monotonic() + self.seconds
+        self.rows = 0
+        self.outer = current()
+        _local.budget = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.budget = self.outer
+        # a progress handler interrupt surfaces as an OperationalError, or
+        # wrapped by pandas as a DatabaseError
+        if exc_type is not None and exc_type is not BudgetExceeded and self.expired():
+            raise BudgetExceeded(self.fn, "time", self.seconds) from exc
+        return False
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def check_time(self):
+        if self.expired():
+            raise BudgetExceeded(self.fn, "time", self.seconds)
+
+    def add_rows(self, n):
+        self.rows += n
+        if self.max_rows is not None and self.rows > self.max_rows:
+            raise BudgetExceeded(self.fn, "row", self.max_rows)
+
+    def check_bytes(self, n):
+        if self.max_bytes is not None and n > self.max_bytes:
+            raise BudgetExceeded(self.fn, "size", self.max_bytes)
+
+
+def current():
+    return getattr(_local, "budget", None)
+
+
+def watch(conn):
+    """
+    Makes a connection honour the current thread's time budget, if any.
+
+    Parameters:
+    conn (sqlite3.Connection): A new connection.
+
+    Returns:
+    sqlite3.Connection: The same connection.
+    """
+    budget = current()
+    if budget is None or budget.deadline is None:
+        return conn
+    budget.check_time()
+    conn.set_progress_handler(lambda: 1 if budget.expired() else 0, PROGRESS_STEPS)
+    return conn
+
+
+def unwatch(conn):
+    # stop a long-lived connection checking a budget that has ended
+    conn.set_progress_handler(None, 0)
+
+
+def interrupt_at_deadline(interrupt):
+    """
+    Calls interrupt when the current thread's time budget runs out, for
+    engines like DuckDB that have no progress handler.
+
+    Parameters:
+    interrupt (callable): Stops the running query, e.g. a cursor's interrupt.
+
+    Returns:
+    threading.Timer or None: The timer, to cancel when the query is done;
+    None if there is no deadline.
+    """
+    budget = current()
+    if budget is None or budget.deadline is None:
+        return None
+    budget.check_time()
+
+    def fire():
+        # Budget.__exit__ only maps the error to a time limit once the
+        # budget has expired, so don't interrupt a moment early
+        while not budget.expired():
+            time.sleep(0.001)
+        interrupt()
+
+    timer = threading.Timer(budget.deadline - time.monotonic(), fire)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def count_rows(n):
+    budget = current()
+    if budget is not None:
+        budget.add_rows(n)
+
+
+def row_limited():
+    budget = current()
+    return budget is not None and budget.max_rows is not None
+
+
+def fetch_counted(cursor):
+    """
+    Fetches a cursor's rows a batch at a time, counting them against the
+    current budget as they arrive.
+
+    Parameters:
+    cursor (sqlite3.Cursor): An executed cursor.
+
+    Returns:
+    list: The rows.
+    """
+    rows = []
+    while True:
+        batch = cursor.fetchmany(FETCH_ROWS)
+        if len(batch) == 0:
+            return rows
+        count_rows(len(batch))
+        rows.extend(batch)
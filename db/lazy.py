@@ -0,0 +1,31 @@
+import importlib
+
+
+class LazyModule:
+    """
+    A module that is only imported when one of its attributes is first used,
+    so importing AeroDB doesn't pay for pandas until a query needs it.
+
+    Parameters:
+    name (str): The module's import name.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name} ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,83 @@
+import json
+import hashlib
+from pathlib import Path
+
+# the routed AeroDB methods, precomputed from list_aerodb_fns() so the API
+# and dashboard don't have to import and introspect AeroDB to start up.
+# The manifest records a hash of aerodb.py and is rebuilt when it changes:
+#   python manifest.py
+HERE = Path(__file__).resolve().parent
+MANIFEST = HERE / "route_manifest.json"
+SOURCE = HERE / "aerodb.py"
+
+_fns = None
+
+
+def source_hash(path=SOURCE):
+    return hashlib.sha1(Path(path).read_bytes()).hexdigest()
+
+
+def build_manifest():
+    from aerodb import list_aerodb_fns
+    return {"source": source_hash(), "fns": list_aerodb_fns()}
+
+
+def write_manifest(path=MANIFEST):
+    """
+    Regenerates the route manifest from list_aerodb_fns().
+
+    Parameters:
+    path (str): Where to write the manifest.
+
+    Returns:
+    dict: The manifest.
+    """
+    manifest = build_manifest()
+    with open(path, "w") as fp:
+        json.dump(manifest, fp, indent=4)
+        fp.write("\n")
+    return manifest
+
+
+def load_manifest(path=MANIFEST):
+    """
+    Reads the route manifest, rebuilding it if it is missing or was built
+    from a different aerodb.py.
+
+    Parameters:
+    path (str): The manifest's path.
+
+    Returns:
+    dict: The manifest.
+    """
+    try:
+        with open(path, "r") as fp:
+            manifest = json.load(fp)
+        if manifest.get("source") == source_hash():
+            return manifest
+    except (OSError, ValueError):
+        pass
+    try:
+        return write_manifest(path)
+    except OSError:
+        # a read-only install still works, it just introspects every start
+        return build_manifest()
+
+
+def route_fns():
+    """
+    Returns the names of the AeroDB methods served by the API, read once
+    from the route manifest.
+
+    Returns:
+    list: The method names.
+    """
+    global _fns
+    if _fns is None:
+        _fns = load_manifest()["fns"]
+    return list(_fns)
+
+
+if __name__ == "__main__":
+    manifest = write_manifest()
+    print(f"{len(manifest['fns'])} routes written to {MANIFEST}")
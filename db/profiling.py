@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+# seconds between stack samples
+INTERVAL = 0.005
+
+
+class Sampler:
+    """
+    A sampling profiler for one thread, or for every thread. A background
+    thread records the target thread's stack every interval; the samples are
+    reported in the collapsed-stack format read by flamegraph.pl and
+    speedscope.
+
+    Work a call hands to another thread (a single-flight leader serving its
+    followers, the write queue's writer, background jobs) only shows up when
+    every thread is sampled. Each stack is then rooted at its thread's name,
+    and includes whatever else the process was running at the time.
+
+    Parameters:
+    thread_id (int, optional): The thread to sample. Defaults to the
+        calling thread.
+    interval (float): Seconds between samples.
+    all_threads (bool): Sample every thread but the sampler's own.
+    """
+
+    def __init__(self, thread_id=None, interval=INTERVAL, all_threads=False):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks = Counter()
+        self.running = False
+        self.thread = None
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        self.running = True
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while self.running:
+            frames = sys._current_frames()
+            if self.all_threads:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in frames.items():
+                    if ident != self.thread.ident:
+                        root = f"thread {names.get(ident, ident)}"
+                        self.stacks[self._stack(frame, root)] += 1
+            elif self.thread_id in frames:
+                self.stacks[self._stack(frames[self.thread_id])] += 1
+            time.sleep(self.interval)
+
+    def _stack(self, frame, root=None):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        if root is not None:
+            names.append(root)
+        return ";".join(reversed(names))
+
+    def collapsed(self):
+        """
+        Returns the samples as collapsed stacks, one "stack count" per line.
+        """
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.collapsed())
+        return path
+
+
+def install_profiling(app, enabled=None, out_dir=None):
+    """
+    Lets requests opt into being profiled with an X-Profile header or a
+    profile query argument, when profiling is enabled for the app.
+
+    The collapsed stacks are written to out_dir and named in the
+    X-Profile-File response header. With profile=return the response body is
+    replaced by the collapsed stacks. A streamed body is produced after the
+    request returns, so it is sampled until the server has sent it.
+
+    Only the request's thread is sampled, unless the request also sends
+    X-Profile-Threads: all or profile_threads=all; see Sampler for what
+    that includes.
+
+    Parameters:
+    app (flask.Flask): The app to install the hooks on.
+    enabled (bool, optional): Defaults to app.config["PROFILING"], or the
+        AERODB_PROFILING environment variable being "1".
+    out_dir (str, optional): Defaults to app.config["PROFILE_DIR"] or
+        /tmp/aerodb_profiles.
+    """
+    from flask import request, g
+
+    if enabled is None:
+        enabled = app.config.get(
+            "PROFILING", os.getenv("AERODB_PROFILING") == "1")
+    if not enabled:
+        return
+    if out_dir is None:
+        out_dir = app.config.get("PROFILE_DIR", "/tmp/aerodb_profiles")
+    os.makedirs(out_dir, exist_ok=True)
+
+    def requested():
+        return request.headers.get("X-Profile") or request.args.get("profile")
+
+    def all_threads():
+        threads = (request.headers.get("X-Profile-Threads")
+                   or request.args.get("profile_threads"))
+        return threads == "all"
+
+    @app.before_request
+    def start_profile():
+        mode = requested()
+        if mode:
+            g.profile_mode = mode
+            g.profiler = Sampler(all_threads=all_threads()).start()
+
+    def finish(sampler, path):
+        if sampler.running:
+            sampler.stop()
+            sampler.save(path)
+        return sampler
+
+    def collapsed_after(body, sampler, path):
+        # send the body to nobody, then the profile of producing it
+        for _ in body:
+            pass
+        yield finish(sampler, path).collapsed()
+
+    @app.after_request
+    def stop_profile(response):
+        sampler = g.pop("profiler", None)
+        if sampler is None:
+            return response
+        mode = g.pop("profile_mode", None)
+        name = f"{request.endpoint}-{int(time.time() * 1000)}.collapsed"
+        path = os.path.join(out_dir, name)
+        response.headers["X-Profile-File"] = path
+        if response.is_streamed:
+            response.call_on_close(lambda: finish(sampler, path))
+            if mode == "return":
+                response.response = collapsed_after(response.response, sampler, path)
+                response.direct_passthrough = False
+                response.mimetype = "text/plain"
+                response.headers.pop("Content-Length", None)
+            return response
+        finish(sampler, path)
+        if mode == "return":
+            response.set_data(sampler.collapsed())
+            response.mimetype = "text/plain"
+            # the ETag, and a 304 from it, were for the replaced body
+            response.headers.pop("ETag", None)
+            if response.status_code == 304:
+                response.status_code = 200
+        response.headers["X-Profile-Elapsed"] = f"{sampler.elapsed:.4f}"
+        return response
+
+
+if __name__ == "__main__":
+    # profile an AeroDB method offline:
+    #   python profiling.py flight_full_data --db-dir /path/to/dbs \
+    #       --kwargs '{"flight_ids": [10000001]}' --out flights.collapsed
+    # with --all-threads, the threads the method starts are sampled too
+    import argparse
+    from aerodb import AeroDB, list_aerodb_fns
+
+    parser = argparse.ArgumentParser(description="Profile an AeroDB method")
+    parser.add_argument("fn", choices=list_aerodb_fns())
+    parser.add_argument("--db-dir", required=True)
+    parser.add_argument("--kwargs", default="{}")
+    parser.add_argument("--interval", type=float, default=INTERVAL)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--all-threads", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["AERODB_DIR"] = args.db_dir
+    db = AeroDB(dev=False)
+    kwargs = json.loads(args.kwargs)
+    sampler = Sampler(interval=args.interval, all_threads=args.all_threads).start()
+    getattr(db, args.fn)(**kwargs)
+    sampler.stop()
+    out = args.out or f"{args.fn}.collapsed"
+    sampler.save(out)
+    print(f"{sum(sampler.stacks.values())} samples over {sampler.elapsed:.3f}s written to {out}")
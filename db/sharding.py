@@ -0,0 +1,251 @@
+import re
+import sqlite3
+from pathlib import Path
+from guards import watch, fetch_counted
+
+# the flight-side tables are the ones that grow with every flight, so they
+# are the ones partitioned into one database file per client
+SHARD_TABLES = ["flights", "flight_ai", "flight_files"]
+SHARD_PREFIX = "aerodb_client_"
+
+# sqlite's default SQLITE_MAX_ATTACHED, cross-shard queries attach at most
+# this many shards at a time
+MAX_ATTACHED = 10
+
+# queries whose result depends on seeing every row at once; across more
+# shards than can be attached together their rows are gathered first
+WHOLE_TABLE = re.compile(
+    r"\b(DISTINCT|GROUP\s+BY|ORDER\s+BY|LIMIT|OFFSET|HAVING|UNION|INTERSECT|EXCEPT)\b"
+    r"|\b(COUNT|SUM|TOTAL|AVG|MIN|MAX|GROUP_CONCAT)\s*\(",
+    re.IGNORECASE)
+
+
+def shard_name(client_id):
+    """
+    Returns the database name of the shard holding a client's flights.
+
+    Parameters:
+    client_id: The client's ID.
+
+    Returns:
+    str: The database name, usable with AeroDB.con(db=...).
+    """
+    return f"{SHARD_PREFIX}{int(client_id)}"
+
+
+def list_shards(base):
+    """
+    Lists the shard databases under a base path.
+
+    Parameters:
+    base (Path): The directory holding the database files.
+
+    Returns:
+    list: The shard database names.
+    """
+    return sorted(p.stem for p in Path(base).glob(SHARD_PREFIX + "*.db"))
+
+
+def query_table(query):
+    """
+    Returns the table a single-table SELECT reads from.
+
+    Parameters:
+    query (str): The SQL query.
+
+    Returns:
+    str or None: The table name, or None if it can't be found.
+    """
+    m = re.search(r"\bFROM\s+(\w+)", query, re.IGNORECASE)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def attach_shards(conn, base, shards):
+    for j, shard in enumerate(shards):
+        path = (Path(base) / (shard + ".db")).as_posix()
+        conn.execute(f"ATTACH DATABASE ? AS s{j}", (path,))
+
+
+def detach_shards(conn, shards):
+    for j in range(len(shards)):
+        conn.execute(f"DETACH DATABASE s{j}")
+
+
+def federated_query(base, query, params, shards, table):
+    """
+    Runs a single-table SELECT across several shard files.
+
+    Shards are attached to an in-memory database, where a temporary view
+    named after the table unions their copies, so the query runs unchanged.
+    With no shards, the query runs over an empty table, so the result still
+    has its columns. Up to MAX_ATTACHED shards are queried at once. Beyond that, plain row
+    queries run per batch of shards and their results are concatenated,
+    while queries that aggregate, deduplicate, sort or limit run once over
+    the rows gathered from every batch, so they see the whole table.
+
+    Parameters:
+    base (Path): The directory holding the database files.
+    query (str): The SQL query to run.
+    params (dict or sequence): The parameters for the query.
+    shards (list): The shard database names to query.
+    table (str): The shard table the query reads from.
+
+    Returns:
+    tuple: The column names and a list of row tuples.
+    """
+    columns = []
+    rows = []
+    # autocommit, sqlite can't detach inside a transaction
+    conn = watch(sqlite3.connect(":memory:", isolation_level=None))
+    try:
+        if len(shards) == 0:
+            # nothing to read, but the result still needs the table's
+            # columns (and aggregates their empty values), so run the query
+            # on an empty copy of the table from any shard, or from the main
+            # file before it was split
+            attach_shards(conn, base, list_shards(base)[:1] or ["aerodb"])
+            conn.execute(
+                f"CREATE TEMP TABLE {table} AS SELECT * FROM s0.{table} WHERE 0")
+            cursor = conn.execute(query, params or ())
+            return [d[0] for d in cursor.description], cursor.fetchall()
+        if len(shards) > MAX_ATTACHED and WHOLE_TABLE.search(query):
+            for i in range(0, len(shards), MAX_ATTACHED):
+                batch = shards[i:i + MAX_ATTACHED]
+                attach_shards(conn, base, batch)
+                if i == 0:
+                    conn.execute(
+                        f"CREATE TEMP TABLE {table} AS SELECT * FROM s0.{table} WHERE 0")
+                for j in range(len(batch)):
+                    conn.execute(f"INSERT INTO temp.{table} SELECT * FROM s{j}.{table}")
+                detach_shards(conn, batch)
+            cursor = conn.execute(query, params or ())
+            return [d[0] for d in cursor.description], fetch_counted(cursor)
+        for i in range(0, len(shards), MAX_ATTACHED):
+            batch = shards[i:i + MAX_ATTACHED]
+            attach_shards(conn, base, batch)
+            union = " UNION ALL ".join(
+                f"SELECT * FROM s{j}.{table}" for j in range(len(batch)))
+            conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+            cursor = conn.execute(query, params or ())
+            columns = [d[0] for d in cursor.description]
+            rows.extend(fetch_counted(cursor))
+            conn.execute(f"DROP VIEW temp.{table}")
+            detach_shards(conn, batch)
+    finally:
+        conn.close()
+    return columns, rows
+
+
+def create_shard_tables(conn, src, dst):
+    """
+    Creates the shard tables missing from one attached shard with the same
+    definitions as another.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection with both shards attached.
+    src (str): The schema name of a shard holding the tables.
+    dst (str): The schema name of the shard to create them in.
+    """
+    existing = [r[0] for r in conn.execute(
+        f"SELECT name FROM {dst}.sqlite_master WHERE type='table'").fetchall()]
+    for table in SHARD_TABLES:
+        if table in existing:
+            continue
+        ddl = conn.execute(
+            f"SELECT sql FROM {src}.sqlite_master WHERE type='table' AND name=?",
+            (table,)).fetchone()[0]
+        ddl = re.sub(r"^CREATE TABLE\s+\"?\w+\"?", f"CREATE TABLE {dst}.{table}", ddl)
+        conn.execute(ddl)
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {dst}.ix_{table}_FLIGHT_ID ON {table} (FLIGHT_ID)")
+
+
+def move_flight(conn, flight_id, client_id, src, dst):
+    """
+    Moves a flight's rows to another client's shard, in the caller's open
+    transaction, and updates the flight_shards routing table.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection to the main database with both
+        shards attached under their shard names.
+    flight_id: The flight's ID.
+    client_id: The flight's new client.
+    src (str): The shard holding the flight.
+    dst (str): The new client's shard.
+    """
+    create_shard_tables(conn, src, dst)
+    for table in SHARD_TABLES:
+        conn.execute(
+            f"INSERT INTO {dst}.{table} SELECT * FROM {src}.{table} WHERE FLIGHT_ID = ?",
+            (flight_id,))
+        conn.execute(f"DELETE FROM {src}.{table} WHERE FLIGHT_ID = ?", (flight_id,))
+    conn.execute(
+        "UPDATE main.flight_shards SET CLIENT_ID = ? WHERE FLIGHT_ID = ?",
+        (client_id, flight_id))
+
+
+def split_into_shards(db, drop=False):
+    """
+    Partitions the flight-side tables of the main database into one shard
+    file per client and records which client each flight belongs to in a
+    flight_shards routing table.
+
+    Parameters:
+    db (AeroDB): The database object whose main file is split.
+    drop (bool): If True, drops the flight-side tables from the main file
+        afterwards and vacuums it.
+
+    Returns:
+    list: The shard database names written.
+    """
+    main_path = (db.base / "aerodb.db").as_posix()
+    conn = db.con()
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS flight_shards "
+        "(FLIGHT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT)")
+    conn.execute("DELETE FROM flight_shards")
+    conn.execute(
+        "INSERT INTO flight_shards SELECT FLIGHT_ID, CLIENT_ID FROM flights")
+    conn.commit()
+    client_ids = [r[0] for r in conn.execute(
+        "SELECT DISTINCT CLIENT_ID FROM flights").fetchall()]
+    ddl = {}
+    for table in SHARD_TABLES:
+        ddl[table] = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name=?",
+            (table,)).fetchone()[0]
+    names = []
+    for client_id in client_ids:
+        name = shard_name(client_id)
+        shard = db.con(name)
+        shard.execute("ATTACH DATABASE ? AS src", (main_path,))
+        for table in SHARD_TABLES:
+            if table == "flights":
+                where = "CLIENT_ID = ?"
+            else:
+                where = "FLIGHT_ID IN (SELECT FLIGHT_ID FROM src.flights WHERE CLIENT_ID = ?)"
+            # qualified, an unqualified name would fall through to src
+            shard.execute(f"DROP TABLE IF EXISTS main.{table}")
+            shard.execute(ddl[table])
+            shard.execute(
+                f"INSERT INTO main.{table} SELECT * FROM src.{table} WHERE {where}",
+                (client_id,))
+            shard.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_FLIGHT_ID ON {table} (FLIGHT_ID)")
+        shard.commit()
+        shard.execute("DETACH DATABASE src")
+        shard.close()
+        names.append(name)
+    # drop the shards of clients that no longer have flights
+    for name in list_shards(db.base):
+        if name not in names:
+            (db.base / (name + ".db")).unlink()
+    if drop:
+        for table in SHARD_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.commit()
+        conn.execute("VACUUM")
+    conn.close()
+    return names
@@ -0,0 +1,99 @@
+import sys
+import time
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, Path(__file__).resolve().parent.as_posix())
+
+from aerodb import AeroDB
+from analytics import Analytics
+from aggregates import SummariesMissing
+from guards import Budget, BudgetExceeded
+
+SCHEMA = """
+CREATE TABLE clients (CLIENT_ID BIGINT PRIMARY KEY, CLIENT_NAME VARCHAR(50));
+CREATE TABLE projects (PROJECT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_NAME VARCHAR(50), STAND_PERSISTENT_IDS TEXT);
+CREATE TABLE stands (STAND_PERSISTENT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    STAND_NAME VARCHAR(50), ACRES FLOAT);
+CREATE TABLE flights (FLIGHT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_ID BIGINT, STAND_PERSISTENT_ID BIGINT, FLIGHT_COMPLETE BOOLEAN);
+CREATE TABLE flight_ai (AI_FLIGHT_ID BIGINT PRIMARY KEY, AI_TPA FLOAT, FLIGHT_ID BIGINT);
+CREATE TABLE flight_files (FILES_FLIGHT_ID BIGINT PRIMARY KEY, CROPPED BOOLEAN,
+    FLIGHT_ID BIGINT);
+INSERT INTO clients VALUES (1, 'one');
+INSERT INTO projects VALUES (100, 1, 'p1', '1000000');
+INSERT INTO stands VALUES (1000000, 1, 's1', 10.0);
+INSERT INTO flights VALUES (10000000, 1, 100, 1000000, 1);
+INSERT INTO flights VALUES (10000001, 1, 100, 1000000, 0);
+INSERT INTO flight_ai VALUES (0, 100.0, 10000000), (1, 120.0, 10000001);
+INSERT INTO flight_files VALUES (0, 1, 10000000), (1, 0, 10000001);
+"""
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    conn = sqlite3.connect((tmp_path / "aerodb.db").as_posix())
+    conn.executescript(SCHEMA)
+    conn.close()
+    monkeypatch.setenv("AERODB_DIR", tmp_path.as_posix())
+    return AeroDB(dev=False)
+
+
+@pytest.fixture
+def queries(db, monkeypatch):
+    # every query the database object runs, in order
+    seen = []
+    execute_query = db.execute_query
+
+    def recording(query=None, *args, **kwargs):
+        seen.append(query)
+        return execute_query(query, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute_query", recording)
+    return seen
+
+
+def select_list(query):
+    cols = query[len("SELECT "):query.index(" FROM ")]
+    return cols if cols == "*" else set(cols.split(", "))
+
+
+def test_data_view_reads_only_the_view_columns(db, queries):
+    view = db.data_view(key="CLIENT_ID", cols=["AI_TPA"])
+    assert sorted(r["AI_TPA"] for r in view[1]) == [100.0, 120.0]
+    reads = {q.split(" FROM ")[1].split()[0]: select_list(q)
+             for q in queries if q.startswith("SELECT") and " WHERE " in q}
+    assert reads["flights"] == {"FLIGHT_ID", "CLIENT_ID", "STAND_PERSISTENT_ID", "PROJECT_ID"}
+    assert reads["flight_ai"] == {"AI_TPA", "FLIGHT_ID"}
+    # tables holding none of the columns aren't read
+    for table in ["flight_files", "stands", "clients", "projects"]:
+        assert table not in reads
+
+
+def test_data_view_without_cols_reads_everything(db, queries):
+    view = db.data_view(key="CLIENT_ID")
+    assert len(view[1]) == 2
+    assert all(select_list(q) == "*" for q in queries if " WHERE " in q)
+
+
+def test_duckdb_query_stops_at_the_deadline(tmp_path):
+    pytest.importorskip("duckdb")
+    engine = Analytics(tmp_path)
+    start = time.monotonic()
+    with pytest.raises(BudgetExceeded) as e:
+        with Budget("data_aggregate", seconds=0.2):
+            engine.query("SELECT COUNT(*) FROM range(10000000000000)")
+    assert e.value.kind == "time"
+    assert time.monotonic() - start < 5
+    # the connection is still usable afterwards
+    assert engine.query("SELECT 1 AS N")["N"].tolist() == [1]
+
+
+def test_summary_before_rebuild_names_the_fix(db):
+    with pytest.raises(SummariesMissing, match="rebuild_summaries"):
+        db.client_summary([1])
+    db.rebuild_summaries()
+    assert db.client_summary([1])[0]["FLIGHTS"] == 2
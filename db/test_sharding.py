@@ -0,0 +1,62 @@
+import sys
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, Path(__file__).resolve().parent.as_posix())
+
+from aerodb import AeroDB
+from sharding import list_shards, split_into_shards
+
+SCHEMA = """
+CREATE TABLE clients (CLIENT_ID BIGINT PRIMARY KEY, CLIENT_NAME VARCHAR(50));
+CREATE TABLE projects (PROJECT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_NAME VARCHAR(50), STAND_PERSISTENT_IDS TEXT);
+CREATE TABLE stands (STAND_PERSISTENT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    STAND_NAME VARCHAR(50), ACRES FLOAT);
+CREATE TABLE flights (FLIGHT_ID BIGINT PRIMARY KEY, CLIENT_ID BIGINT,
+    PROJECT_ID BIGINT, STAND_PERSISTENT_ID BIGINT, FLIGHT_COMPLETE BOOLEAN);
+CREATE TABLE flight_ai (AI_FLIGHT_ID BIGINT PRIMARY KEY, AI_TPA FLOAT, FLIGHT_ID BIGINT);
+CREATE TABLE flight_files (FILES_FLIGHT_ID BIGINT PRIMARY KEY, CROPPED BOOLEAN,
+    FLIGHT_ID BIGINT);
+INSERT INTO clients VALUES (1, 'one'), (2, 'two'), (3, 'no flights');
+INSERT INTO projects VALUES (100, 1, 'p1', '1000000'), (200, 2, 'p2', '1000001');
+INSERT INTO stands VALUES (1000000, 1, 's1', 10.0), (1000001, 2, 's2', 20.0);
+INSERT INTO flights VALUES (10000000, 1, 100, 1000000, 1);
+INSERT INTO flights VALUES (10000001, 2, 200, 1000001, 0);
+INSERT INTO flight_ai VALUES (0, 100.0, 10000000), (1, 120.0, 10000001);
+INSERT INTO flight_files VALUES (0, 1, 10000000), (1, 0, 10000001);
+"""
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    conn = sqlite3.connect((tmp_path / "aerodb.db").as_posix())
+    conn.executescript(SCHEMA)
+    conn.close()
+    monkeypatch.setenv("AERODB_DIR", tmp_path.as_posix())
+    db = AeroDB(dev=False, shard_by="client")
+    split_into_shards(db, drop=True)
+    assert len(list_shards(tmp_path)) == 2
+    return db
+
+
+def test_lookup_matching_no_shard_keeps_columns(db):
+    flights = db.where_table_in("flights", "CLIENT_ID", [3], "FLIGHT_ID")
+    assert list(flights.columns) == ["FLIGHT_ID"]
+    assert len(flights) == 0
+    records = db.where_table_in("flights", "CLIENT_ID", [3], json_out=True)
+    assert records == []
+
+
+def test_aggregate_over_no_shards(db):
+    rows = db.execute_query("SELECT COUNT(*) AS N FROM flights", shards=[])
+    assert rows == [{"N": 0}]
+
+
+def test_client_without_flights_has_empty_view(db):
+    assert db.client_flights_full_data([3]) == {}
+    view = db.client_flights_full_data([1])
+    assert list(view.keys()) == [1]
+    assert [f["FLIGHT_ID"] for f in view[1]] == [10000000]
@@ -0,0 +1,79 @@
+# tables edited from the dashboard carry a row version that every update
+# bumps, so an edit made against a stale copy of a row can be detected
+VERSION_COL = "ROW_VERSION"
+VERSIONED_TABLES = ["clients", "projects", "stands", "flights"]
+
+
+def add_row_versions(conn, tables=VERSIONED_TABLES):
+    """
+    Adds the row version column to tables that don't have it yet.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection to the database holding the tables.
+    tables (list): The tables to version. Tables missing from the database
+        are skipped.
+    """
+    existing = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+    for table in tables:
+        if table not in existing:
+            continue
+        cols = [c[1] for c in conn.execute(f"PRAGMA table_info({table})")]
+        if VERSION_COL in cols:
+            continue
+        conn.execute(
+            f"ALTER TABLE {table} ADD COLUMN {VERSION_COL} INTEGER NOT NULL DEFAULT 0")
+    conn.commit()
+
+
+def conditional_update(conn, table, id_col, uid, changes, version=None,
+                       commit=True, schema="main"):
+    """
+    Updates the given columns of one row and returns the row as it was
+    before and after. This takes two statements in one transaction: a
+    SELECT of the old row, then an UPDATE ... RETURNING of the new one.
+    SQLite's RETURNING only sees the new values, so the old row has to be
+    read first; the transaction is taken with BEGIN IMMEDIATE, so no other
+    writer can change the row in between. Rows with
+    a version column always have their version bumped; with a version, the
+    update only applies if the row is still at that version.
+
+    Parameters:
+    conn (sqlite3.Connection): A connection with sqlite3.Row as row factory.
+    table (str): The name of the table.
+    id_col (str): The table's ID column.
+    uid: The ID of the row to update.
+    changes (dict): The columns to set and their new values.
+    version (int, optional): The row version the caller last saw.
+    commit (bool): If False, the update is left in the open transaction.
+    schema (str): The attached database holding the table.
+
+    Returns:
+    tuple: The row before and after the update, as dicts. The row after is
+    None if the row didn't match, and both are None if there is no such row.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    before = conn.execute(
+        f"SELECT * FROM {schema}.{table} WHERE {id_col} = ?", (uid,)).fetchone()
+    if before is None:
+        if commit:
+            conn.commit()
+        return None, None
+    before = dict(before)
+    sets = [f"{k} = ?" for k in changes.keys()]
+    params = list(changes.values())
+    where = f"{id_col} = ?"
+    params.append(uid)
+    if VERSION_COL in before:
+        sets.append(f"{VERSION_COL} = {VERSION_COL} + 1")
+    if version is not None:
+        where += f" AND {VERSION_COL} = ?"
+        params.append(version)
+    query = f"UPDATE {schema}.{table} SET {', '.join(sets)} WHERE {where} RETURNING *"
+    rows = conn.execute(query, params).fetchall()
+    if commit:
+        conn.commit()
+    if len(rows) == 0:
+        return before, None
+    return before, dict(rows[0])
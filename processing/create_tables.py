@@ -1,7 +1,32 @@
+import io
+import os
 import pandas as pd
 import sqlite3
 from sqlalchemy import (create_engine, BigInteger, Float, Date, String, Boolean)
 from uuid import uuid4
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from resolver import KeyResolver, normalize
+import sys
+sys.path.append("/home/aerotract/software/aerotract_db/db")
+from aggregates import rebuild_summaries
+from versioning import add_row_versions
+from sharding import list_shards, split_into_shards
+
+# rows per chunk when reading raw CSVs, and rows per executemany batch when
+# writing tables
+CHUNKSIZE = 50000
+BATCH_SIZE = 5000
+# processes parsing and matching the flight metadata
+WORKERS = os.cpu_count() or 1
+# the metadata's name columns, normalized before matching
+METADATA_CLEAN_COLS = ["CLIENT_ID", "PROJECT_ID", "STAND_NAME"]
+
+# resolvers used during this run, kept for the unmatched-keys report
+RESOLVERS = []
+
+AERODB_DIR = "/home/aerotract/.aerodb"
 
 def get_engine(table_name="aerodb"):
     # use an engine to write out a DF to SQL
@@ -14,13 +39,79 @@ def get_connection(table_name="aerodb"):
     return sqlite3.connect(db)
 
 def cleanstr(df, col):
-        repl = [".", "&"]
-        repl = "[" + "".join(repl) + "]"
-        df[col] = df[col].str.strip()
-        df[col] = df[col].str.replace(repl, "_", regex=True)
-        df[col] = df[col].str.replace(" ", "")
-        df[col] = df[col].str.upper()
-        return df
+    df[col] = normalize(df[col])
+    return df
+
+def make_resolver(table, keys, id_col, normalize_cols=[]):
+    # index a table on its natural key once and remember it for the report
+    df = pd.read_sql(f"select * from {table}", get_connection())
+    resolver = KeyResolver(df, keys, id_col, name=table,
+                           normalize_cols=normalize_cols)
+    RESOLVERS.append(resolver)
+    return resolver
+
+def unmatched_report():
+    # every key that failed to resolve during this run, one row per lookup
+    # table and key. Some inputs are matched more than once (activeprojects
+    # by two steps), so a key's count is the most seen in any one pass
+    reports = [r.report() for r in RESOLVERS if len(r.unmatched) > 0]
+    if len(reports) == 0:
+        return pd.DataFrame()
+    report = pd.concat(reports, ignore_index=True)
+    keys = [c for c in report.columns if c != "count"]
+    counts = report.groupby(keys, dropna=False, sort=False)["count"].max()
+    return counts.reset_index()[report.columns.tolist()]
+
+def read_raw_chunks(raw_data_path, clean_cols=[], chunksize=CHUNKSIZE):
+    # read a raw CSV in chunks, cleaning the name columns chunk by chunk;
+    # always yields at least one (possibly empty) chunk
+    dtype = {c: str for c in clean_cols}
+    empty = True
+    for chunk in pd.read_csv(raw_data_path, chunksize=chunksize, dtype=dtype):
+        for col in clean_cols:
+            chunk = cleanstr(chunk, col)
+        empty = False
+        yield chunk
+    if empty:
+        yield pd.read_csv(raw_data_path, nrows=0, dtype=dtype)
+
+def read_raw_blocks(raw_data_path, chunksize=CHUNKSIZE):
+    # split a raw CSV into blocks of about chunksize records without parsing
+    # it, so workers can parse them; each block is the header line plus its
+    # records, as bytes. A line only ends a record when the quotes seen so
+    # far are balanced, so quoted fields may hold newlines. Always yields at
+    # least one (possibly header-only) block
+    with open(raw_data_path, "rb") as fp:
+        header = fp.readline()
+        lines = []
+        n = 0
+        quotes = 0
+        empty = True
+        for line in fp:
+            lines.append(line)
+            quotes += line.count(b'"')
+            if quotes % 2 == 1:
+                continue
+            n += 1
+            if n == chunksize:
+                yield header + b"".join(lines)
+                empty = False
+                lines = []
+                n = 0
+        if empty or len(lines) > 0:
+            yield header + b"".join(lines)
+
+def read_raw_csv(raw_data_path, clean_cols=[], chunksize=CHUNKSIZE):
+    # the whole cleaned CSV, for the raw files that are small enough to hold
+    chunks = list(read_raw_chunks(raw_data_path, clean_cols, chunksize))
+    return pd.concat(chunks, ignore_index=True)
+
+def write_table(name, df, dtypes_map=None, index_label=None, batch_size=BATCH_SIZE):
+    # replace a table inside a single transaction, inserting in batches
+    engine = get_engine()
+    with engine.begin() as conn:
+        df.to_sql(name, con=conn, if_exists='replace', dtype=dtypes_map,
+                  index_label=index_label, chunksize=batch_size)
 
 def create_clients_db(raw_data_path="data/clients-raw.csv"):
     # Step 1 of migrating TaskMaster - clients
@@ -37,18 +128,13 @@ def create_clients_db(raw_data_path="data/clients-raw.csv"):
     # clean some values
     df["CLIENT_CREATION_DATA"] = pd.to_datetime(df["CLIENT_CREATION_DATA"])
     df = cleanstr(df, "CLIENT_NAME")
-    engine = get_engine()
-    df.to_sql('clients', con=engine, if_exists='replace', dtype=dtypes_map, index_label="CLIENT_ID")
+    write_table('clients', df, dtypes_map, "CLIENT_ID")
 
 def match_client_names(df):
     # given a df with "CLIENT_ID" being the client name, return a list of matching IDs
-    client_conn = get_connection()
-    query_ids = []
-    for _, c in df.iterrows():
-        query = "SELECT client_id FROM clients where client_name = :name"
-        id_query = pd.read_sql(query, client_conn, params={"name": c["CLIENT_ID"]})
-        query_ids.append(id_query["CLIENT_ID"][0])
-    return query_ids
+    resolver = make_resolver("clients", ["CLIENT_NAME"], "CLIENT_ID",
+                             normalize_cols=["CLIENT_NAME"])
+    return resolver.resolve(df, ["CLIENT_ID"])
 
 def create_projects_db(raw_data_path="data/projects-raw.csv"):
     df = pd.read_csv(raw_data_path)
@@ -64,46 +150,21 @@ def create_projects_db(raw_data_path="data/projects-raw.csv"):
     df["CLIENT_ID"] = match_client_names(df)
     dtypes = [BigInteger, BigInteger, String(50), Date, String(255), String(255)]
     dtypes_map = {c: d for c,d in zip(table_cols, dtypes)}
-    engine = get_engine()
-    df.to_sql('projects', con=engine, if_exists='replace', dtype=dtypes_map, index_label="PROJECT_ID")
+    write_table('projects', df, dtypes_map, "PROJECT_ID")
 
 def match_project_names(df):
     # given a df with "PROJECT_ID" being the name and "CLIENT_ID" being the ID, return a list
     # of the corresponding project IDs for each entry, or -1 if they are missing
-    project_conn = get_connection()
-    query = "select * from projects"
-    pquery = pd.read_sql(query, project_conn)
-    pquery_ids = []
-    for _, c in df.iterrows():
-        projmask = pquery["PROJECT_NAME"] == c["PROJECT_ID"]
-        climask = pquery["CLIENT_ID"] == c["CLIENT_ID"]
-        msg = ""
-        if projmask.sum() == 0:
-            msg += "no project found: " + str(c["PROJECT_ID"])
-        if climask.sum() == 0:
-            if len(msg) != 0:
-                msg += "\n"
-            msg += "no client found: " + str(c["CLIENT_ID"])
-        if len(msg) != 0:
-            print("---------------")
-            print(msg)
-            print("---------------")
-        pq = pquery[(projmask) & (climask)]
-        if len(pq) == 0:
-            pquery_ids.append(-1)
-        else:
-            pquery_ids.append(pq.iloc[0]["PROJECT_ID"])
-    return pquery_ids
+    resolver = make_resolver("projects", ["PROJECT_NAME", "CLIENT_ID"], "PROJECT_ID",
+                             normalize_cols=["PROJECT_NAME"])
+    return resolver.resolve(df, ["PROJECT_ID", "CLIENT_ID"])
 
 def load_and_process_activeprojects(raw_data_path="data/activeprojects-raw.csv"):
-    df = pd.read_csv(raw_data_path)
     df_cols = ["Client", "Project", "ID", "Site", "Acres"]
+    df = read_raw_csv(raw_data_path, ["Client", "Project", "Site"])
     df = df[df_cols]
     table_cols = ["CLIENT_ID", "PROJECT_ID", "STAND_ID", "STAND_NAME", "ACRES"]
     df.columns = table_cols
-    df = cleanstr(df, "CLIENT_ID")
-    df = cleanstr(df, "PROJECT_ID")
-    df = cleanstr(df, "STAND_NAME")
     df["CLIENT_ID"] = match_client_names(df)
     df["PROJECT_ID"] = match_project_names(df)
     df["STAND_PERSISTENT_ID"] = list(range(1000000, df.shape[0]+1000000))
@@ -111,18 +172,17 @@ def load_and_process_activeprojects(raw_data_path="data/activeprojects-raw.csv")
     return df
 
 def create_stands_from_activeprojects_db(raw_data_path="data/activeprojects-raw.csv"):
-    engine = get_engine()
     df = load_and_process_activeprojects(raw_data_path)
     stand_proj_df = df[["STAND_PERSISTENT_ID", "PROJECT_ID"]]
     stand_proj_df.set_index("STAND_PERSISTENT_ID", inplace=True)
     sp_dtypes = [BigInteger, BigInteger]
     sp_dtypes_map = {c: d for c,d in zip(stand_proj_df.columns, sp_dtypes)}
-    stand_proj_df.to_sql('stand_project_ids', con=engine, if_exists='replace', dtype=sp_dtypes_map, index_label="STAND_PERSISTENT_ID")
+    write_table('stand_project_ids', stand_proj_df, sp_dtypes_map, "STAND_PERSISTENT_ID")
     del df["PROJECT_ID"]
     dtypes = [BigInteger, BigInteger, String(50), Float]
     dtypes_map = {c: d for c,d in zip(df.columns, dtypes)}
     df.set_index("STAND_PERSISTENT_ID", inplace=True)
-    df.to_sql('stands', con=engine, if_exists='replace', dtype=dtypes_map, index_label="STAND_PERSISTENT_ID")
+    write_table('stands', df, dtypes_map, "STAND_PERSISTENT_ID")
 
 def add_stand_ids_to_projects_db():
     project_conn = get_connection()
@@ -136,38 +196,96 @@ def add_stand_ids_to_projects_db():
         proj_stand_ids = ",".join([str(x) for x in uids])
         stand_ids.append(proj_stand_ids)
     projects["STAND_PERSISTENT_IDS"] = stand_ids
-    engine = get_engine()
     projects.set_index("PROJECT_ID", inplace=True)
-    projects.to_sql('projects', con=engine, if_exists='replace', index_label="PROJECT_ID")
+    write_table('projects', projects, index_label="PROJECT_ID")
 
-def load_and_process_metadata(raw_data_path="data/projectmeta-raw.csv"):
-    df = pd.read_csv(raw_data_path)
-    df = cleanstr(df, "CLIENT_ID")
-    df = cleanstr(df, "PROJECT_ID")
-    df = cleanstr(df, "STAND_NAME")
-    df["CLIENT_ID"] = match_client_names(df)
-    df["PROJECT_ID"] = match_project_names(df)
-    df["FLIGHT_ID"] = list(range(10000000, df.shape[0]+10000000))
+def metadata_resolvers():
+    # the client, project and stand resolvers, built once per pass over the
+    # metadata and shared by all of its chunks
+    clients = make_resolver("clients", ["CLIENT_NAME"], "CLIENT_ID",
+                            normalize_cols=["CLIENT_NAME"])
+    projects = make_resolver("projects", ["PROJECT_NAME", "CLIENT_ID"], "PROJECT_ID",
+                             normalize_cols=["PROJECT_NAME"])
+    stands = make_resolver("stands", ["STAND_ID", "STAND_NAME"], "STAND_PERSISTENT_ID",
+                           normalize_cols=["STAND_NAME"])
+    return clients, projects, stands
+
+def process_metadata(df, resolvers, first_id=10000000):
+    # replace the names in one chunk of metadata with IDs and number its flights
+    clients, projects, stands = resolvers
+    df["CLIENT_ID"] = clients.resolve(df, ["CLIENT_ID"])
+    df["PROJECT_ID"] = projects.resolve(df, ["PROJECT_ID", "CLIENT_ID"])
+    df["FLIGHT_ID"] = list(range(first_id, df.shape[0]+first_id))
     df.set_index("FLIGHT_ID", inplace=True)
-    conn = get_connection()
-    stands = pd.read_sql("select * from stands", conn)
-    stand_pids = []
-    for _, row in df.iterrows():
-        stand = stands[(stands["STAND_ID"] == row["STAND_ID"]) & (stands["STAND_NAME"] == row["STAND_NAME"])]
-        stand_pids.append(stand["STAND_PERSISTENT_ID"].values[0])
-    df["STAND_PERSISTENT_ID"] = stand_pids
+    df["STAND_PERSISTENT_ID"] = stands.resolve(df)
     return df
 
-def create_flights_db(raw_data_path="data/projectmeta-raw.csv"):
-    df = load_and_process_metadata(raw_data_path)
+# the resolvers of a metadata worker process, sent to it once when it starts
+_worker_resolvers = None
+
+def init_metadata_worker(resolvers):
+    global _worker_resolvers
+    _worker_resolvers = resolvers
+
+def process_metadata_block(block):
+    # parse, clean and match one block of raw metadata in a worker. The
+    # flights are numbered from 0 here and renumbered in file order by
+    # iter_metadata; the keys the worker's resolvers failed to match go back
+    # with the chunk for the report
+    dtype = {c: str for c in METADATA_CLEAN_COLS}
+    df = pd.read_csv(io.BytesIO(block), dtype=dtype)
+    for col in METADATA_CLEAN_COLS:
+        df = cleanstr(df, col)
+    df = process_metadata(df, _worker_resolvers, first_id=0)
+    unmatched = []
+    for resolver in _worker_resolvers:
+        unmatched.append(resolver.unmatched)
+        resolver.unmatched = []
+    return df, unmatched
+
+def iter_metadata(raw_data_path="data/projectmeta-raw.csv", chunksize=CHUNKSIZE,
+                  workers=WORKERS):
+    # parse, clean and match the metadata in a process pool, sending each
+    # worker only its own block, and yield the chunks in file order. At most
+    # two blocks per worker are in flight, so memory stays bounded; flight
+    # IDs carry on across chunks
+    resolvers = metadata_resolvers()
+    blocks = read_raw_blocks(raw_data_path, chunksize)
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_metadata_worker,
+                               initargs=(resolvers,))
+    try:
+        pending = deque(pool.submit(process_metadata_block, b)
+                        for b in islice(blocks, 2 * workers))
+        first_id = 10000000
+        while len(pending) > 0:
+            df, unmatched = pending.popleft().result()
+            for block in islice(blocks, 1):
+                pending.append(pool.submit(process_metadata_block, block))
+            for resolver, keys in zip(resolvers, unmatched):
+                resolver.unmatched.extend(keys)
+            n = df.shape[0]
+            df.index = pd.Index(range(first_id, first_id + n), name="FLIGHT_ID")
+            first_id += n
+            yield df
+    finally:
+        # a caller that stops early doesn't wait for the rest of the file
+        pool.shutdown(cancel_futures=True)
+
+def load_and_process_metadata(raw_data_path="data/projectmeta-raw.csv"):
+    return pd.concat(list(iter_metadata(raw_data_path)))
+
+# the build_* functions select and reshape processed metadata, a chunk at a
+# time when given the chunk's row offset; each returns the arguments for
+# write_table
+
+def build_flights(df, offset=0):
     table_cols = ["CLIENT_ID", "PROJECT_ID", "STAND_PERSISTENT_ID", "FLIGHT_COMPLETE"] # FLIGHT_ID is index
     df = df[table_cols]
     dtypes = [BigInteger, BigInteger, BigInteger, Boolean]
     dtypes_map = {c: d for c,d in zip(df.columns, dtypes)}
-    df.to_sql('flights', con=get_engine(), if_exists='replace', dtype=dtypes_map, index_label="FLIGHT_ID")
+    return 'flights', df, dtypes_map, "FLIGHT_ID"
 
-def create_flight_ai_db(raw_data_path="data/projectmeta-raw.csv"):
-    df = load_and_process_metadata(raw_data_path)
+def build_flight_ai(df, offset=0):
     table_cols = ['TRAINING_READY', 'TRAINING_DONE',
        'AI_READY', 'AI_OUTPUT', 'QA_DONE', 'AI_RESULT_MODELED', 'QC_READY',
        'AI_TPA', 'QC_PLOT_TPA', 'AI_TREE_COUNT_RED', 'AI_TREE_COUNT_BROWN',
@@ -179,13 +297,12 @@ def create_flight_ai_db(raw_data_path="data/projectmeta-raw.csv"):
               BigInteger]
     df = df[table_cols]
     df[df.index.name] = df.index
-    df["AI_FLIGHT_ID"] = list(range(df.shape[0]))
+    df["AI_FLIGHT_ID"] = list(range(offset, df.shape[0]+offset))
     df.set_index("AI_FLIGHT_ID", inplace=True)
     dtypes_map = {c: d for c,d in zip(df.columns, dtypes)}
-    df.to_sql('flight_ai', con=get_engine(), if_exists='replace', dtype=dtypes_map, index_label="AI_FLIGHT_ID")
+    return 'flight_ai', df, dtypes_map, "AI_FLIGHT_ID"
 
-def create_flight_files_db(raw_data_path="data/projectmeta-raw.csv"):
-    df = load_and_process_metadata(raw_data_path)
+def build_flight_files(df, offset=0):
     table_cols = [
         "FLIGHT_IMAGES_DELIVERED", "FLIGHT_PLANS_NAS", "FLIGHT_IMAGES_DD", "SHP_NAS", "KML_NAS",
         "INDIVIDUAL_SHP_NAS", "GRID_QA_NAS", "RAW_IMAGES_NAS", "POLYGON_DD",
@@ -199,14 +316,72 @@ def create_flight_files_db(raw_data_path="data/projectmeta-raw.csv"):
         BigInteger
     ]
     df = df[table_cols]
-    df["FILES_FLIGHT_ID"] = list(range(df.shape[0]))
+    df["FILES_FLIGHT_ID"] = list(range(offset, df.shape[0]+offset))
     df[df.index.name] = df.index
     df.set_index("FILES_FLIGHT_ID", inplace=True)
     dtypes_map = {c: d for c,d in zip(df.columns, dtypes)}
-    df.to_sql('flight_files', con=get_engine(), if_exists='replace', dtype=dtypes_map, index_label="FILES_FLIGHT_ID")
+    return 'flight_files', df, dtypes_map, "FILES_FLIGHT_ID"
+
+def create_flights_db(raw_data_path="data/projectmeta-raw.csv", df=None):
+    if df is None:
+        df = load_and_process_metadata(raw_data_path)
+    write_table(*build_flights(df))
+
+def create_flight_ai_db(raw_data_path="data/projectmeta-raw.csv", df=None):
+    if df is None:
+        df = load_and_process_metadata(raw_data_path)
+    write_table(*build_flight_ai(df))
+
+def create_flight_files_db(raw_data_path="data/projectmeta-raw.csv", df=None):
+    if df is None:
+        df = load_and_process_metadata(raw_data_path)
+    write_table(*build_flight_files(df))
+
+def create_flight_tables(raw_data_path="data/projectmeta-raw.csv", chunksize=CHUNKSIZE,
+                         workers=WORKERS):
+    # build flights, flight_ai and flight_files from the metadata one chunk
+    # at a time, writing each chunk's rows as soon as it is matched; the
+    # chunks are matched in parallel, but this process is the only writer
+    # and the three tables are replaced in a single transaction
+    builders = [build_flights, build_flight_ai, build_flight_files]
+    engine = get_engine()
+    offset = 0
+    with engine.begin() as conn:
+        for chunk in iter_metadata(raw_data_path, chunksize, workers):
+            if_exists = 'replace' if offset == 0 else 'append'
+            for build in builders:
+                name, df, dtypes_map, index_label = build(chunk, offset)
+                df.to_sql(name, con=conn, if_exists=if_exists, dtype=dtypes_map,
+                          index_label=index_label, chunksize=BATCH_SIZE)
+            offset += chunk.shape[0]
+
+def build_summaries():
+    # recompute the client/project/stand rollups AeroDB keeps up to date
+    conn = get_connection()
+    conn.row_factory = sqlite3.Row
+    tables = ["flights", "flight_ai", "stands", "projects"]
+    rows = [[dict(r) for r in conn.execute(f"select * from {t}")] for t in tables]
+    rebuild_summaries(conn, *rows)
+    conn.close()
+
+def version_editable_tables():
+    # the dashboard's optimistic-concurrency edits need a row version column
+    conn = get_connection()
+    add_row_versions(conn)
+    conn.close()
+
+def reshard_flight_tables():
+    # the flight tables were just rewritten in the main file, so rebuild the
+    # per-client shards from them on installs that use shards
+    if len(list_shards(AERODB_DIR)) == 0:
+        return
+    from aerodb import AeroDB
+    os.environ["AERODB_DIR"] = AERODB_DIR
+    split_into_shards(AeroDB(dev=False, shard_by="client"))
 
 def check_columns():
-    meta = load_and_process_metadata()
+    # the first chunk has every column
+    meta = next(iter_metadata())
     flights = pd.read_sql("select * from flights", get_connection())
     ai = pd.read_sql("select * from flight_ai", get_connection())
     files = pd.read_sql("select * from flight_files", get_connection())
@@ -218,16 +393,23 @@ def check_columns():
     print(set(meta.columns) - set(cols))
 
 if __name__ == "__main__":
+    RESOLVERS.clear()
     order = [ 
         create_clients_db,
         create_projects_db,
         create_stands_from_activeprojects_db,
         add_stand_ids_to_projects_db,
-        create_flights_db,
-        create_flight_ai_db,
-        create_flight_files_db,
+        create_flight_tables,
+        build_summaries,
+        version_editable_tables,
+        reshard_flight_tables,
         check_columns,
     ]
 
     for fn in order:
-        fn()
\ No newline at end of file
+        fn()
+
+    unmatched = unmatched_report()
+    if len(unmatched) > 0:
+        unmatched.to_csv("data/unmatched-keys.csv", index=False)
+        print(f"{len(unmatched)} unmatched keys written to data/unmatched-keys.csv")
\ No newline at end of file
@@ -0,0 +1,104 @@
+import pandas as pd
+
+
+def normalize(col):
+    # the normalization cleanstr applies to names: strip, replace "." and
+    # "&" with "_", drop spaces, uppercase
+    col = col.str.strip()
+    col = col.str.replace("[.&]", "_", regex=True)
+    col = col.str.replace(" ", "")
+    return col.str.upper()
+
+
+class KeyResolver:
+    """
+    Resolves natural keys (names, or tuples of name and parent ID) to IDs
+    through a hash index built once over a lookup table.
+
+    Parameters:
+    df (pandas.DataFrame): The lookup table, e.g. the clients table.
+    keys (list): The natural key columns of the lookup table.
+    id_col (str): The ID column to resolve keys to.
+    name (str, optional): A label used in the unmatched-keys report.
+    normalize_cols (list, optional): Key columns to normalize like cleanstr
+        before indexing and probing.
+    """
+
+    def __init__(self, df, keys, id_col, name=None, normalize_cols=[]):
+        self.keys = list(keys)
+        self.id_col = id_col
+        self.name = name or id_col
+        self.normalize_cols = list(normalize_cols)
+        table = self._prepare(df[self.keys + [id_col]].copy(), self.keys)
+        # the first row wins on duplicate keys, matching the old row scans
+        table = table.drop_duplicates(subset=self.keys, keep="first")
+        self.index = self._make_index(table, self.keys)
+        self.ids = table[id_col].to_numpy()
+        self.unmatched = []
+
+    def _prepare(self, df, cols):
+        for key, col in zip(self.keys, cols):
+            if key in self.normalize_cols:
+                df[col] = normalize(df[col].astype("string"))
+        return df
+
+    def _make_index(self, df, cols):
+        if len(cols) == 1:
+            return pd.Index(df[cols[0]])
+        frame = df[cols].copy()
+        frame.columns = self.keys
+        return pd.MultiIndex.from_frame(frame)
+
+    def resolve(self, df, cols=None, missing=-1):
+        """
+        Resolves a whole column (or set of columns) of natural keys in one
+        vectorized pass.
+
+        Parameters:
+        df (pandas.DataFrame): The rows to resolve.
+        cols (list, optional): The columns in df holding the key parts, in
+            the same order as the resolver's keys. Defaults to the keys.
+        missing: The value used for keys that don't resolve.
+
+        Returns:
+        list: The resolved IDs, one per row of df.
+        """
+        cols = self.keys if cols is None else list(cols)
+        probe = self._prepare(df[cols].copy(), cols)
+        pos = self.index.get_indexer(self._make_index(probe, cols))
+        found = pos >= 0
+        ids = pd.Series(missing, index=df.index, dtype=object)
+        ids[found] = self.ids[pos[found]]
+        if not found.all():
+            self._record(probe[~found], cols)
+        return ids.tolist()
+
+    def _record(self, probe, cols):
+        counts = probe.value_counts(subset=cols, dropna=False)
+        for key, count in counts.items():
+            if not isinstance(key, tuple):
+                key = (key,)
+            entry = {"resolver": self.name, "count": int(count)}
+            for i, k in enumerate(self.keys):
+                entry[k] = key[i]
+                # note which key parts exist on their own, like the old
+                # "no project found" / "no client found" messages
+                if len(self.keys) > 1:
+                    level = self.index.get_level_values(i)
+                    entry[k + "_FOUND"] = bool(level.isin([key[i]]).any())
+            self.unmatched.append(entry)
+
+    def report(self):
+        """
+        Returns the keys that failed to resolve, with how often each was seen
+        across every resolve call (e.g. every chunk of an input).
+
+        Returns:
+        pandas.DataFrame: One row per unmatched key.
+        """
+        report = pd.DataFrame(self.unmatched)
+        if len(report) == 0:
+            return report
+        keys = [c for c in report.columns if c != "count"]
+        counts = report.groupby(keys, dropna=False, sort=False)["count"].sum()
+        return counts.reset_index()[report.columns.tolist()]